@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+ROOT_DIR = SCRIPT_DIR.parent
+GENERATOR = SCRIPT_DIR / 'regenerate_index.py'
+DEFAULT_OUTPUT = ROOT_DIR / '.cache' / 'benchmark.json'
+IMAGE_REF_RE = re.compile(r'^!\[.*?\]\((.*?)\)$', re.M)
+SAMPLE_IMAGE = 'assets/chapt02_images/ch02_p02_01.jpg'
+SYNTHETIC_MODULES = 4
+
+# One unit of each synthetic variant; a scale of N repeats it N times per module.
+SYNTHETIC_UNITS = {
+    'tables': '''### Confronto {n}
+Tabella di confronto **{n}** tra le opzioni, con `codice` e [fonte](https://example.com/{n}).
+
+| Criterio | Opzione A | Opzione B | Note |
+| --- | --- | --- | --- |
+| Costo | **Basso** | Medio | Stima {n} |
+| Rischio | Medio | *Alto* | Da validare |
+| Tempo | 4 settimane | 2 settimane | `T+{n}` |
+| Qualità dati | Buona | Discreta | Vedi audit |
+''',
+    'lists': '''### Checklist {n}
+- **Obiettivo:** definire il perimetro {n} e le metriche di successo.
+- **Dati:** verificare qualità, copertura e *bias* del dataset.
+- **Rischi:** mappare i rischi con il `risk-register` del progetto.
+1. Raccogliere i requisiti.
+2. Validare con gli stakeholder.
+3. Pianificare il rilascio {n}.
+''',
+    'images': f'''### Figura {{n}}
+Descrizione del diagramma {{n}} con i passaggi principali.
+
+![Diagramma {{n}}]({SAMPLE_IMAGE})
+*Figura {{n}}: schema del processo*
+''',
+}
+
+
+def load_generator(revision: str = None):
+    if revision is None:
+        spec = importlib.util.spec_from_file_location('regenerate_index', GENERATOR)
+        module = importlib.util.module_from_spec(spec)
+        # Registered so the parse cache can pickle the module's node classes.
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        return module
+    source = subprocess.run(
+        ['git', 'show', f'{revision}:scripts/regenerate_index.py'],
+        cwd=ROOT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    module = types.ModuleType(f'regenerate_index_{revision}')
+    module.__file__ = str(GENERATOR)
+    sys.modules[module.__name__] = module
+    exec(compile(source, f'{revision}:scripts/regenerate_index.py', 'exec'), module.__dict__)
+    return module
+
+
+def best_of(repeat: int, func, *args):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def synthetic_course(variant: str, scale: int) -> str:
+    unit = SYNTHETIC_UNITS[variant]
+    parts = [f'# Corso sintetico ({variant} x{scale})\n']
+    for number in range(1, SYNTHETIC_MODULES + 1):
+        parts.append(f'\n## Modulo {number:02d}: Modulo sintetico {number}\n')
+        parts.extend(unit.format(n=f'{number}.{i}') for i in range(scale))
+    return '\n'.join(parts)
+
+
+def _reset_peak_rss() -> bool:
+    # Linux only: writing 5 to clear_refs resets VmHWM, so each phase gets its own peak.
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb(per_phase: bool) -> int:
+    if per_phase:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _measure(repeat: int, func):
+    per_phase = _reset_peak_rss()
+    seconds, output = best_of(repeat, func)
+    return {'seconds': round(seconds, 6), 'peak_rss_kb': _peak_rss_kb(per_phase), 'output_bytes': output}
+
+
+def _html_bytes(pages) -> int:
+    return sum(len(page.encode('utf-8')) for page in pages)
+
+
+def _format_all_inline(generator, fragments):
+    cache_clear = getattr(generator.format_inline, 'cache_clear', None)
+    if cache_clear:
+        cache_clear()
+    return _html_bytes(generator.format_inline(fragment) for fragment in fragments)
+
+
+def _build_module_pages(generator, course):
+    ctx = generator.RenderContext.from_course(course)
+    return _html_bytes(generator.build_module_page(ctx, idx) for idx in range(len(course[1])))
+
+
+def _regenerate_cold(generator, workdir: Path):
+    for path in workdir.iterdir():
+        if path.suffix == '.html':
+            path.unlink()
+    shutil.rmtree(workdir / '.cache', ignore_errors=True)
+    shutil.rmtree(workdir / 'assets' / 'search', ignore_errors=True)
+    before = {path for path in workdir.rglob('*') if path.is_file()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator.regenerate()
+    return sum(
+        path.stat().st_size for path in workdir.rglob('*')
+        if path.is_file() and path not in before and '.cache' not in path.parts
+    )
+
+
+def _prepare_workdir(markdown: str) -> Path:
+    workdir = Path(tempfile.mkdtemp(prefix='regenerate-bench-'))
+    (workdir / 'course.md').write_text(markdown, encoding='utf-8')
+    for src in sorted(set(IMAGE_REF_RE.findall(markdown))):
+        source = ROOT_DIR / src
+        if source.is_file():
+            target = workdir / src
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
+    return workdir
+
+
+def run_body_case(revision, markdown: str, repeat: int):
+    # course.md concatenated N times through body_to_html alone; the output
+    # digest lets --compare assert that an optimization changed no byte.
+    generator = load_generator(revision)
+    per_phase = _reset_peak_rss()
+    seconds, output = best_of(repeat, generator.body_to_html, markdown)
+    phase = {
+        'seconds': round(seconds, 6),
+        'peak_rss_kb': _peak_rss_kb(per_phase),
+        'output_bytes': len(output.encode('utf-8')),
+        'output_sha256': hashlib.sha256(output.encode('utf-8')).hexdigest(),
+    }
+    return {'input_bytes': len(markdown.encode('utf-8')), 'phases': {'body_to_html': phase}}
+
+
+def run_case(revision, markdown: str, repeat: int):
+    # Runs in a fresh process, so one case's heap never inflates the next one's RSS.
+    generator = load_generator(revision)
+    phases = {}
+    seconds, course = best_of(repeat, generator.parse_course, markdown)
+    phases['parse_course'] = {'seconds': round(seconds, 6), 'peak_rss_kb': _peak_rss_kb(False), 'output_bytes': None}
+    bodies = [module['body'] for module in course[1]]
+    fragments = [line.strip() for line in markdown.splitlines() if line.strip()]
+    steps = {
+        'body_to_html': lambda: _html_bytes(generator.body_to_html(body) for body in bodies),
+        'format_inline': lambda: _format_all_inline(generator, fragments),
+        'build_module_page': lambda: _build_module_pages(generator, course),
+    }
+    for name, func in steps.items():
+        try:
+            phases[name] = _measure(repeat, func)
+        except (AttributeError, TypeError) as exc:
+            phases[name] = {'error': f'unsupported by this revision: {exc}'}
+
+    workdir = _prepare_workdir(markdown)
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        phases['regenerate'] = _measure(repeat, lambda: _regenerate_cold(generator, workdir))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'input_bytes': len(markdown.encode('utf-8')), 'phases': phases}
+
+
+def compare(results, baseline, tolerance: float):
+    regressions = []
+    mismatches = []
+    print(f'{"case":<18} {"phase":<18} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for case, data in results['cases'].items():
+        base_case = baseline.get('cases', {}).get(case)
+        if not base_case:
+            continue
+        for phase, current in data['phases'].items():
+            previous = base_case['phases'].get(phase, {})
+            if 'seconds' not in current or not previous.get('seconds'):
+                continue
+            ratio = current['seconds'] / previous['seconds']
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions.append((case, phase, ratio))
+            if current.get('output_bytes') != previous.get('output_bytes'):
+                flag += f"  output {previous.get('output_bytes')} -> {current.get('output_bytes')} bytes"
+            if 'output_sha256' in previous and current.get('output_sha256') != previous['output_sha256']:
+                flag += '  OUTPUT DIFFERS'
+                mismatches.append((case, phase))
+            print(
+                f'{case:<18} {phase:<18} {previous["seconds"] * 1000:>8.1f}ms {current["seconds"] * 1000:>8.1f}ms '
+                f'{ratio:>6.2f}x{flag}'
+            )
+    return regressions, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the site generator on course.md and on synthetic scaled inputs.'
+    )
+    parser.add_argument('--scales', default='10,100,1000', help='synthetic scales, comma separated (default: 10,100,1000)')
+    parser.add_argument(
+        '--variants',
+        default=','.join(SYNTHETIC_UNITS),
+        help=f'synthetic variants, comma separated (default: {",".join(SYNTHETIC_UNITS)})',
+    )
+    parser.add_argument(
+        '--copies',
+        type=int,
+        default=50,
+        help='also time body_to_html on course.md concatenated this many times, 0 to skip (default: 50)',
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='runs per phase; the best one is reported (default: 3)')
+    parser.add_argument('--revision', metavar='REV', help='benchmark the generator at this git revision instead')
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT, help=f'JSON results file (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--compare', type=Path, metavar='BASELINE', help='compare against a stored results file')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.15,
+        help='with --compare, fail when a phase is slower than the baseline by more than this fraction (default: 0.15)',
+    )
+    args = parser.parse_args(argv)
+
+    variants = [v for v in args.variants.split(',') if v]
+    unknown = [v for v in variants if v not in SYNTHETIC_UNITS]
+    if unknown:
+        parser.error(f'unknown variant(s): {", ".join(unknown)}')
+    scales = [int(s) for s in args.scales.split(',') if s]
+
+    markdown = (ROOT_DIR / 'course.md').read_text(encoding='utf-8')
+    cases = {'course': (run_case, markdown)}
+    if args.copies > 0:
+        cases[f'course-x{args.copies}'] = (run_body_case, '\n'.join([markdown] * args.copies))
+    for variant in variants:
+        for scale in scales:
+            cases[f'{variant}-x{scale}'] = (run_case, synthetic_course(variant, scale))
+
+    results = {
+        'meta': {
+            'revision': args.revision or 'working tree',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'cases': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for case, (runner, case_markdown) in cases.items():
+            data = pool.apply(runner, (args.revision, case_markdown, args.repeat))
+            results['cases'][case] = data
+            summary = ', '.join(
+                f'{phase} {values["seconds"] * 1000:.1f}ms' for phase, values in data['phases'].items()
+                if 'seconds' in values
+            )
+            print(f'- {case} ({data["input_bytes"] / 1024:.0f} KB): {summary}')
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2) + '\n', encoding='utf-8')
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        regressions, mismatches = compare(results, json.loads(args.compare.read_text(encoding='utf-8')), args.tolerance)
+        if mismatches:
+            print(f'{len(mismatches)} phase(s) render different output than {args.compare}', file=sys.stderr)
+        if regressions:
+            print(f'{len(regressions)} phase(s) slower than {args.compare} by more than {args.tolerance:.0%}',
+                  file=sys.stderr)
+        if mismatches or regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
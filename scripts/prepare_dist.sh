@@ -4,16 +4,8 @@ set -euo pipefail
 ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 DIST_DIR="$ROOT_DIR/dist"
 
-rm -rf "$DIST_DIR"
-mkdir -p "$DIST_DIR"
-
-# Publish root HTML pages (index + modules + risk forms)
-cp -a "$ROOT_DIR"/*.html "$DIST_DIR"/ || true
-
-# Publish static resources used by the pages
-if [ -d "$ROOT_DIR/assets" ]; then
-  cp -a "$ROOT_DIR/assets" "$DIST_DIR/assets"
-fi
-if [ -d "$ROOT_DIR/scripts" ]; then
-  cp -a "$ROOT_DIR/scripts" "$DIST_DIR/scripts"
-fi
+# Build incrementally, then sync dist/: root HTML pages (index + modules +
+# risk forms), only the assets they reference, and scripts/. Unchanged files
+# are left in place, so repeated runs do almost nothing.
+cd "$ROOT_DIR"
+python3 scripts/regenerate_index.py --incremental --dist "$DIST_DIR"
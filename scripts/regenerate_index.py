@@ -1,11 +1,74 @@
 #!/usr/bin/env python3
+import argparse
+import contextlib
+import cProfile
+import ctypes
+import ctypes.util
+import functools
+import gzip
+import hashlib
 import html
+import io
+import itertools
+import json
+import os
+import pickle
+import pstats
 import re
+import select
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import unquote
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+GENERATOR_PATH = Path(__file__).resolve()
 COURSE_MD = Path('course.md')
 HOME_HTML = Path('index.html')
+FULL_COURSE_HTML = Path('course-full.html')
+FULL_COURSE_PDF = Path('course-full.pdf')
+PDF_RENDERERS = ('chromium', 'chromium-browser', 'google-chrome', 'google-chrome-stable', 'chrome', 'msedge')
+CACHE_DIR = Path('.cache')
+BUILD_MANIFEST = CACHE_DIR / 'build-manifest.json'
+SITE_ASSETS_DIR = Path('assets')
+OPTIMIZED_IMAGES_DIR = SITE_ASSETS_DIR / '_optimized'
+IMAGE_MANIFEST = CACHE_DIR / 'images.json'
+IMAGE_HEADER_CACHE = CACHE_DIR / 'image-headers.json'
+PARSE_CACHE = CACHE_DIR / 'parse.pickle'
+DIST_DIR = Path('dist')
+DIST_MANIFEST = CACHE_DIR / 'dist-manifest.json'
+# Published as a whole, as prepare_dist.sh always did.
+DIST_EXTRA_DIRS = (Path('scripts'),)
+DIST_EXCLUDED_NAMES = {'desktop.ini', 'Thumbs.db', '.DS_Store', '__pycache__'}
+FICLONE = 0x40049409
+BUILD_REPORT = CACHE_DIR / 'build-report.json'
+SEARCH_INDEX_DIR = SITE_ASSETS_DIR / 'search'
+SEARCH_LANGS = ('it', 'en')
+SEARCH_CACHE = CACHE_DIR / 'search-documents.pickle'
+SERVICE_WORKER = Path('sw.js')
+SERVICE_WORKER_CACHE = CACHE_DIR / 'service-worker.json'
+RASTER_IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.webp'}
+# Widths cover phones, the 820px figure column and its 2x density.
+IMAGE_WIDTHS = (480, 820, 1640)
+IMAGE_SIZES = '(max-width: 868px) calc(100vw - 48px), 820px'
+IMAGE_FORMATS = ('avif', 'webp')
+IMAGE_QUALITY = {'avif': 55, 'webp': 78}
+WRITE_BUFFER_SIZE = 1 << 16
+PRECOMPRESS_SUFFIXES = {'.html', '.css', '.js', '.svg', '.json'}
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
 
 
 def parse_course(markdown: str):
@@ -69,131 +132,144 @@ def parse_course(markdown: str):
     return title, modules, labs_body, bibliography_body, home_note_body, en_translations
 
 
+INLINE_RE = re.compile(
+    r'`(?P<code>.+?)`'
+    r'|\[(?P<label>[^\]]+)\]\((?P<href>[^)\s]+)\)'
+    r'|\*\*(?P<strong>.+?)\*\*'
+    r'|\*(?!\*)(?P<em>.+?)(?<!\*)\*(?!\*)'
+)
+
+
+@functools.lru_cache(maxsize=4096)
 def format_inline(text: str) -> str:
-    escaped = html.escape(text)
-    def _replace_link(match):
-        label = match.group(1)
-        href = html.unescape(match.group(2))
-        safe_href = html.escape(href, quote=True)
-        if href.startswith('http://') or href.startswith('https://'):
-            return f'<a href="{safe_href}" target="_blank" rel="noopener noreferrer">{label}</a>'
-        return f'<a href="{safe_href}">{label}</a>'
-
-    escaped = re.sub(r'\[([^\]]+)\]\(([^)\s]+)\)', _replace_link, escaped)
-    escaped = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', escaped)
-    escaped = re.sub(r'\*(.+?)\*', r'<em>\1</em>', escaped)
-    escaped = re.sub(r'`(.+?)`', r'<code>\1</code>', escaped)
-    return escaped
-
-
-def split_table_cells(row_line: str):
+    return _format_escaped(html.escape(text))
+
+
+def _format_escaped(escaped: str) -> str:
+    # One left-to-right scan; spans are formatted recursively so markers never
+    # leak across tags, and code spans are kept verbatim.
+    if '*' not in escaped and '`' not in escaped and '[' not in escaped:
+        return escaped
+    out = []
+    pos = 0
+    for match in INLINE_RE.finditer(escaped):
+        out.append(escaped[pos:match.start()])
+        kind = match.lastgroup
+        if kind == 'code':
+            out.append(f'<code>{match.group("code")}</code>')
+        elif kind == 'href':
+            # The text is already escaped (quote=True), so the href is safe as-is.
+            href = match.group('href')
+            label = _format_escaped(match.group('label'))
+            if href.startswith('http://') or href.startswith('https://'):
+                out.append(f'<a href="{href}" target="_blank" rel="noopener noreferrer">{label}</a>')
+            else:
+                out.append(f'<a href="{href}">{label}</a>')
+        elif kind == 'strong':
+            out.append(f'<strong>{_format_escaped(match.group("strong"))}</strong>')
+        else:
+            out.append(f'<em>{_format_escaped(match.group("em"))}</em>')
+        pos = match.end()
+    out.append(escaped[pos:])
+    return ''.join(out)
+
+
+TABLE_SEPARATOR_CELL_RE = re.compile(r'^:?-{3,}:?$')
+TABLE_SEPARATOR_CHARS_RE = re.compile(r'^[\s|:-]+$')
+H3_RE = re.compile(r'^###\s+(.+)$')
+H4_RE = re.compile(r'^####\s+(.+)$')
+CARD_STOP_RE = re.compile(r'^#{3,4}\s+.+$')
+IMAGE_RE = re.compile(r'^!\[(.*?)\]\((.*?)\)$')
+CAPTION_RE = re.compile(r'^\*(.*?)\*$')
+ORDERED_ITEM_RE = re.compile(r'^\d+\.\s+(.+)$')
+MAJOR_HEADING_RE = re.compile(r'^(\d+)\.\s+(.+)$')
+SUB_HEADING_RE = re.compile(r'^(\d+)\.(\d+)\s+(.+)$')
+NUMBERED_H4_RE = re.compile(r'^(\d+)\.(\d+)\.(\d+)\s+(.+)$')
+
+CARD_HEADINGS = {
+    'scheda rapida del modulo': 'quick-card',
+    'checklist dei concetti principali': 'checklist-card',
+    'principali punti di fine sezione': 'checklist-card',
+}
+
+
+def _split_row(row_line: str):
     cleaned = row_line.strip()
     if cleaned.startswith('|'):
         cleaned = cleaned[1:]
     if cleaned.endswith('|'):
         cleaned = cleaned[:-1]
-    return [format_inline(cell.strip()) for cell in cleaned.split('|')]
-
-
-def is_table_separator(row_line: str) -> bool:
-    if '|' not in row_line:
-        return False
-    cells = split_table_cells(row_line)
-    if not cells:
-        return False
-    return all(re.match(r'^:?-{3,}:?$', html.unescape(cell)) for cell in cells)
-
-
-def body_to_html(body: str) -> str:
-    lines = body.splitlines()
-    out = []
+    return [cell.strip() for cell in cleaned.split('|')]
+
+
+def table_alignments(row_line: str):
+    # Column alignments of a separator row (None per column without a colon
+    # marker), or None when the line is not a separator. Separator cells only
+    # hold `:`, `-` and spaces, so they are matched raw, never formatted.
+    if '|' not in row_line or not TABLE_SEPARATOR_CHARS_RE.match(row_line):
+        return None
+    alignments = []
+    for cell in _split_row(row_line):
+        if not TABLE_SEPARATOR_CELL_RE.match(cell):
+            return None
+        if cell[0] == ':':
+            alignments.append('center' if cell[-1] == ':' else 'left')
+        else:
+            alignments.append('right' if cell[-1] == ':' else None)
+    return alignments
+
+
+def tokenize_blocks(body: str):
+    return _tokenize_lines(body.splitlines())
+
+
+def _tokenize_lines(lines):
+    # Each line is classified once: tables first (they may start with any
+    # character), then a dispatch on the first character of the line.
+    tokens = []
+    append = tokens.append
+    count = len(lines)
     i = 0
-    slug_counter = {}
-    current_major = 1
-    current_minor = 0
-    current_subminor = 0
-    seen_major_heading = False
-
-    def _normalize_slug(value: str) -> str:
-        slug = unicodedata.normalize('NFD', value.lower())
-        slug = ''.join(ch for ch in slug if unicodedata.category(ch) != 'Mn')
-        slug = re.sub(r'[^a-z0-9]+', '-', slug).strip('-')
-        return slug or 'section'
-
-    def _heading_id(text: str) -> str:
-        base = _normalize_slug(text)
-        count = slug_counter.get(base, 0) + 1
-        slug_counter[base] = count
-        return base if count == 1 else f'{base}-{count}'
 
-    while i < len(lines):
+    while i < count:
         line = lines[i].strip()
 
         if not line:
             i += 1
             continue
 
-        if (
-            '|' in line
-            and i + 1 < len(lines)
-            and is_table_separator(lines[i + 1].strip())
-        ):
-            header_cells = split_table_cells(line)
+        alignments = '|' in line and i + 1 < count and table_alignments(lines[i + 1].strip())
+        if alignments:
+            header_cells = _split_row(line)
             i += 2
-
             rows = []
-            while i < len(lines):
+            while i < count:
                 current = lines[i].strip()
                 if not current or '|' not in current:
                     break
-                if is_table_separator(current):
-                    i += 1
-                    continue
-                rows.append(split_table_cells(current))
+                if table_alignments(current) is None:
+                    rows.append(_split_row(current))
                 i += 1
-
-            max_cols = len(header_cells)
-            for row in rows:
-                max_cols = max(max_cols, len(row))
-
-            def normalize(cells):
-                return cells + [''] * (max_cols - len(cells))
-
-            thead = ''.join(f'<th>{cell}</th>' for cell in normalize(header_cells))
-            tbody_rows = []
-            for row in rows:
-                tds = ''.join(f'<td>{cell}</td>' for cell in normalize(row))
-                tbody_rows.append(f'<tr>{tds}</tr>')
-
-            tbody = ''.join(tbody_rows)
-            out.append(
-                '<div class="table-wrap">'
-                '<table class="content-table">'
-                f'<thead><tr>{thead}</tr></thead>'
-                f'<tbody>{tbody}</tbody>'
-                '</table>'
-                '</div>'
-            )
+            append(('table', header_cells, rows, alignments))
             continue
 
-        h3_match = re.match(r'^###\s+(.+)$', line)
-        if h3_match:
-            heading_text_raw = h3_match.group(1).strip()
-            heading_text = heading_text_raw
-            heading_id = _heading_id(heading_text)
-            heading_key = heading_text.lower()
-            if heading_key in {
-                'scheda rapida del modulo',
-                'checklist dei concetti principali',
-                'principali punti di fine sezione',
-            }:
+        lead = line[0]
+
+        if lead == '#':
+            h3_match = H3_RE.match(line)
+            if h3_match:
+                heading_text = h3_match.group(1).strip()
+                card_class = CARD_HEADINGS.get(heading_text.lower())
                 i += 1
+                if not card_class:
+                    append(('h3', heading_text))
+                    continue
                 block_lines = []
                 seen_content = False
-                while i < len(lines):
+                while i < count:
                     current_raw = lines[i]
                     current = current_raw.strip()
-                    if re.match(r'^###\s+.+$', current) or re.match(r'^####\s+.+$', current):
+                    if CARD_STOP_RE.match(current):
                         break
                     if not current:
                         if seen_content:
@@ -203,116 +279,400 @@ def body_to_html(body: str) -> str:
                     seen_content = True
                     block_lines.append(current_raw)
                     i += 1
-
-                card_html = body_to_html('\n'.join(block_lines).strip('\n'))
-                card_class = 'quick-card' if heading_key == 'scheda rapida del modulo' else 'checklist-card'
-                out.append(
-                    f'<section class="{card_class}">'
-                    f'<h3 id="{heading_id}" class="module-subtitle">{format_inline(heading_text)}</h3>'
-                    f'{card_html}'
-                    '</section>'
-                )
+                append(('card', heading_text, card_class, _tokenize_lines(block_lines)))
                 continue
 
-            major_match = re.match(r'^(\d+)\.\s+(.+)$', heading_text_raw)
-            sub_match = re.match(r'^(\d+)\.(\d+)\s+(.+)$', heading_text_raw)
-            if major_match:
-                current_major = int(major_match.group(1))
-                current_minor = 0
-                current_subminor = 0
-                seen_major_heading = True
-                heading_text = heading_text_raw
-                heading_id = _heading_id(heading_text)
-                out.append(f'<h2 id="{heading_id}" class="module-section-title">{format_inline(heading_text)}</h2>')
+            h4_match = H4_RE.match(line)
+            if h4_match:
+                append(('h4', h4_match.group(1).strip()))
                 i += 1
                 continue
-            if sub_match:
-                current_major = int(sub_match.group(1))
-                current_minor = int(sub_match.group(2))
-                current_subminor = 0
-                heading_text = heading_text_raw
-            else:
-                if not seen_major_heading:
-                    current_major = 1
-                current_minor += 1
-                current_subminor = 0
-                heading_text = f'{current_major}.{current_minor} {heading_text_raw}'
-
-            heading_id = _heading_id(heading_text)
-            out.append(f'<h3 id="{heading_id}" class="module-subtitle">{format_inline(heading_text)}</h3>')
-            i += 1
-            continue
 
-        h4_match = re.match(r'^####\s+(.+)$', line)
-        if h4_match:
-            heading_text_raw = h4_match.group(1).strip()
-            numbered_h4 = re.match(r'^(\d+)\.(\d+)\.(\d+)\s+(.+)$', heading_text_raw)
-            if numbered_h4:
-                heading_text = heading_text_raw
-            else:
-                current_subminor += 1
-                heading_text = f'{current_major}.{max(current_minor, 1)}.{current_subminor} {heading_text_raw}'
-            heading_id = _heading_id(heading_text)
-            out.append(f'<h4 id="{heading_id}" class="module-subtitle-small">{format_inline(heading_text)}</h4>')
-            i += 1
-            continue
+        elif lead == '!':
+            img_match = IMAGE_RE.match(line)
+            if img_match:
+                caption = None
+                if i + 1 < count:
+                    caption_match = CAPTION_RE.match(lines[i + 1].strip())
+                    if caption_match:
+                        caption = caption_match.group(1).strip()
+                        i += 1
+                append(('figure', img_match.group(1).strip(), img_match.group(2).strip(), caption))
+                i += 1
+                continue
 
-        img_match = re.match(r'^!\[(.*?)\]\((.*?)\)$', line)
-        if img_match:
-            alt = format_inline(img_match.group(1).strip())
-            src = html.escape(img_match.group(2).strip(), quote=True)
-            caption_html = ''
-            if i + 1 < len(lines):
-                next_line = lines[i + 1].strip()
-                caption_match = re.match(r'^\*(.*?)\*$', next_line)
-                if caption_match:
-                    caption = format_inline(caption_match.group(1).strip())
-                    caption_html = (
-                        '<figcaption class="figure-caption">'
-                        f'{caption}'
-                        '</figcaption>'
-                    )
+        elif lead.isdecimal():
+            if ORDERED_ITEM_RE.match(line):
+                items = []
+                while i < count:
+                    match = ORDERED_ITEM_RE.match(lines[i].strip())
+                    if not match:
+                        break
+                    items.append(match.group(1).strip())
                     i += 1
+                append(('ol', items))
+                continue
 
-            out.append(
-                '<figure class="module-image">'
-                f'<img src="{src}" alt="{alt}" onclick="this.classList.toggle(\'zoomed\')">'
-                f'{caption_html}'
-                '</figure>'
-            )
-            i += 1
-            continue
-
-        if re.match(r'^\d+\.\s+.+$', line):
-            items = []
-            while i < len(lines):
-                current = lines[i].strip()
-                match = re.match(r'^\d+\.\s+(.+)$', current)
-                if not match:
-                    break
-                items.append(format_inline(match.group(1).strip()))
-                i += 1
-            lis = ''.join(f'<li>{item}</li>' for item in items)
-            out.append(f'<ol>{lis}</ol>')
-            continue
-
-        if line.startswith('- '):
+        elif lead == '-' and line.startswith('- '):
             items = []
-            while i < len(lines):
+            while i < count:
                 current = lines[i].strip()
                 if not current.startswith('- '):
                     break
-                items.append(format_inline(current[2:].strip()))
+                items.append(current[2:].strip())
                 i += 1
-            lis = ''.join(f'<li>{item}</li>' for item in items)
-            out.append(f'<ul>{lis}</ul>')
+            append(('ul', items))
             continue
 
-        out.append(f'<p>{format_inline(line)}</p>')
+        append(('paragraph', line))
         i += 1
 
-    return '\n'.join(out)
+    return tokens
+
+
+class FigureRenderer:
+    # Per-page figure state: the first `eager` figures are fetched with high
+    # priority, the rest (below the first screen) lazily. Known dimensions
+    # reserve the layout box before the image arrives.
+
+    def __init__(self, images=None, dimensions=None, eager: int = 1):
+        self.images = images or {}
+        self.dimensions = dimensions or {}
+        self.eager = eager
+        self.count = 0
+
+    def render(self, src_text: str, alt: str, caption_html: str) -> str:
+        self.count += 1
+        src = html.escape(src_text, quote=True)
+        image = self.images.get(src_text)
+        size = (image['width'], image['height']) if image else self.dimensions.get(src_text)
+        attrs = f' width="{size[0]}" height="{size[1]}"' if size else ''
+        if self.count <= self.eager:
+            attrs += ' fetchpriority="high"'
+        else:
+            attrs += ' loading="lazy" decoding="async"'
+        img = f'<img src="{src}" alt="{alt}"{attrs} onclick="this.classList.toggle(\'zoomed\')">'
+        if image:
+            img = f'<picture>{picture_sources(image)}{img}</picture>'
+        return f'<figure class="module-image">{img}{caption_html}</figure>'
+
+    def for_page(self, eager: int = 1):
+        return FigureRenderer(self.images, self.dimensions, eager)
+
+
+def _fold_accents_slow(value: str) -> str:
+    value = unicodedata.normalize('NFD', value)
+    return ''.join(ch for ch in value if unicodedata.category(ch) != 'Mn')
+
+
+def _accent_fold_table():
+    # Latin letters with diacritics (and bare combining marks) mapped to what
+    # NFD + dropping Mn gives for them; characters that do not fold to ASCII
+    # are left out and handled by the slow path.
+    ranges = (range(0x80, 0x250), range(0x300, 0x370), range(0x1E00, 0x1F00))
+    table = {}
+    for codepoint in (cp for block in ranges for cp in block):
+        folded = _fold_accents_slow(chr(codepoint))
+        if folded.isascii() and folded != chr(codepoint):
+            table[codepoint] = folded
+    return table
+
+
+ACCENT_FOLD_TABLE = _accent_fold_table()
+SLUG_SEPARATOR_RE = re.compile(r'[^a-z0-9]+')
+
+
+def fold_accents(value: str) -> str:
+    value = value.lower()
+    folded = value.translate(ACCENT_FOLD_TABLE)
+    # Per-character folding equals the NFD pass whenever the result is plain ASCII.
+    return folded if folded.isascii() else _fold_accents_slow(value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_slug(value: str) -> str:
+    slug = SLUG_SEPARATOR_RE.sub('-', fold_accents(value)).strip('-')
+    return slug or 'section'
+
+
+class HeadingNumbering:
+    # Section numbers and unique anchor ids for one block sequence. The HTML
+    # emitter and the search index both walk tokens through it, so they agree
+    # on every id.
+
+    def __init__(self):
+        self.slug_counter = {}
+        self.major = 1
+        self.minor = 0
+        self.subminor = 0
+        self.seen_major_heading = False
+
+    def heading_id(self, text: str) -> str:
+        base = _normalize_slug(text)
+        count = self.slug_counter.get(base, 0) + 1
+        self.slug_counter[base] = count
+        return base if count == 1 else f'{base}-{count}'
+
+    def h3(self, heading_text_raw: str):
+        # The raw text always claims a slug first; existing deep links depend on it.
+        self.heading_id(heading_text_raw)
+        major_match = MAJOR_HEADING_RE.match(heading_text_raw)
+        if major_match:
+            self.major = int(major_match.group(1))
+            self.minor = 0
+            self.subminor = 0
+            self.seen_major_heading = True
+            return 'h2', self.heading_id(heading_text_raw), heading_text_raw
+        sub_match = SUB_HEADING_RE.match(heading_text_raw)
+        if sub_match:
+            self.major = int(sub_match.group(1))
+            self.minor = int(sub_match.group(2))
+            self.subminor = 0
+            heading_text = heading_text_raw
+        else:
+            if not self.seen_major_heading:
+                self.major = 1
+            self.minor += 1
+            self.subminor = 0
+            heading_text = f'{self.major}.{self.minor} {heading_text_raw}'
+        return 'h3', self.heading_id(heading_text), heading_text
+
+    def h4(self, heading_text_raw: str):
+        if NUMBERED_H4_RE.match(heading_text_raw):
+            heading_text = heading_text_raw
+        else:
+            self.subminor += 1
+            heading_text = f'{self.major}.{max(self.minor, 1)}.{self.subminor} {heading_text_raw}'
+        return self.heading_id(heading_text), heading_text
+
+
+HEADING_CLASSES = {'h2': 'module-section-title', 'h3': 'module-subtitle', 'h4': 'module-subtitle-small'}
+
+
+class Node:
+    # Course tree nodes: built once per body, numbering and ids included, and
+    # walked by every renderer (HTML, outline, search, full course, export).
+    __slots__ = ()
+    kind = ''
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def to_json(self):
+        data = {'type': self.kind}
+        for name in self.__slots__:
+            data[name] = _node_json(getattr(self, name))
+        return data
+
+
+def _node_json(value):
+    if isinstance(value, Node):
+        return value.to_json()
+    if isinstance(value, list):
+        return [_node_json(item) for item in value]
+    return value
+
+
+class Heading(Node):
+    __slots__ = ('tag', 'id', 'text')
+    kind = 'heading'
+
+
+class Paragraph(Node):
+    __slots__ = ('text',)
+    kind = 'paragraph'
+
+
+class Table(Node):
+    __slots__ = ('header', 'rows', 'align')
+    kind = 'table'
+
+
+class Figure(Node):
+    __slots__ = ('alt', 'src', 'caption')
+    kind = 'figure'
+
+
+class ListBlock(Node):
+    __slots__ = ('ordered', 'items')
+    kind = 'list'
+
+
+class Card(Node):
+    __slots__ = ('heading', 'card_class', 'children')
+    kind = 'card'
+
+
+class Module(Node):
+    __slots__ = ('number', 'title', 'teaser', 'blocks')
+    kind = 'module'
+
+
+class Course(Node):
+    __slots__ = ('title', 'modules', 'labs', 'bibliography', 'home_note', 'translations')
+    kind = 'course'
+
+
+def build_blocks(tokens, numbering=None):
+    numbering = numbering or HeadingNumbering()
+    blocks = []
+    append = blocks.append
+    for token in tokens:
+        kind = token[0]
+        if kind == 'paragraph':
+            append(Paragraph(token[1]))
+        elif kind == 'h3':
+            append(Heading(*numbering.h3(token[1])))
+        elif kind == 'h4':
+            append(Heading('h4', *numbering.h4(token[1])))
+        elif kind == 'card':
+            _, heading_text, card_class, children = token
+            heading = Heading('h3', numbering.heading_id(heading_text), heading_text)
+            # Card children are their own block sequence, with fresh numbering.
+            append(Card(heading, card_class, build_blocks(children)))
+        elif kind == 'table':
+            append(Table(*token[1:]))
+        elif kind == 'figure':
+            append(Figure(*token[1:]))
+        elif kind in ('ol', 'ul'):
+            append(ListBlock(kind == 'ol', token[1]))
+    return blocks
+
+
+def parse_blocks(body: str):
+    return build_blocks(tokenize_blocks(body))
+
+
+def build_course_tree(course) -> Course:
+    title, modules, labs_body, bibliography_body, home_note_body, en_translations = course
+    return Course(
+        title,
+        [Module(m['number'], m['title'], first_teaser(m['body']), parse_blocks(m['body'])) for m in modules],
+        parse_blocks(labs_body or ''),
+        parse_blocks(bibliography_body or ''),
+        parse_blocks(home_note_body or ''),
+        [
+            Module(num, t['title'], first_teaser(t['body']), parse_blocks(t['body']))
+            for num, t in sorted(en_translations.items())
+        ],
+    )
+
+
+def iter_blocks(blocks, figures=None):
+    if figures is None:
+        figures = FigureRenderer()
+
+    for block in blocks:
+        kind = block.kind
 
+        if kind == 'paragraph':
+            yield f'<p>{format_inline(block.text)}</p>'
+
+        elif kind == 'heading':
+            tag = block.tag
+            yield f'<{tag} id="{block.id}" class="{HEADING_CLASSES[tag]}">{format_inline(block.text)}</{tag}>'
+
+        elif kind == 'card':
+            heading = block.heading
+            yield (
+                f'<section class="{block.card_class}">'
+                f'<h3 id="{heading.id}" class="module-subtitle">{format_inline(heading.text)}</h3>'
+                f'{render_blocks(block.children, figures)}'
+                '</section>'
+            )
+
+        elif kind == 'table':
+            header_cells, rows = block.header, block.rows
+            max_cols = max(len(header_cells), *map(len, rows)) if rows else len(header_cells)
+            # Per-column opening tags; short rows are padded with the empty
+            # cells of the missing columns instead of copying the row.
+            styles = [
+                f' style="text-align: {align}"' if align else ''
+                for align in itertools.islice(itertools.chain(block.align, itertools.repeat(None)), max_cols)
+            ]
+            th_open = [f'<th{style}>' for style in styles]
+            td_open = [f'<td{style}>' for style in styles]
+            th_empty = [f'{tag}</th>' for tag in th_open]
+            td_empty = [f'{tag}</td>' for tag in td_open]
+
+            thead = ''.join(
+                [f'{th_open[col]}{format_inline(cell)}</th>' for col, cell in enumerate(header_cells)]
+                + th_empty[len(header_cells):]
+            )
+            tbody = ''.join(
+                '<tr>'
+                + ''.join([f'{td_open[col]}{format_inline(cell)}</td>' for col, cell in enumerate(row)])
+                + ''.join(td_empty[len(row):])
+                + '</tr>'
+                for row in rows
+            )
+            yield (
+                '<div class="table-wrap">'
+                '<table class="content-table">'
+                f'<thead><tr>{thead}</tr></thead>'
+                f'<tbody>{tbody}</tbody>'
+                '</table>'
+                '</div>'
+            )
+
+        elif kind == 'figure':
+            alt = format_inline(block.alt)
+            caption_html = ''
+            if block.caption is not None:
+                caption_html = (
+                    '<figcaption class="figure-caption">'
+                    f'{format_inline(block.caption)}'
+                    '</figcaption>'
+                )
+            yield figures.render(block.src, alt, caption_html)
+
+        elif kind == 'list':
+            tag = 'ol' if block.ordered else 'ul'
+            lis = ''.join(f'<li>{format_inline(item)}</li>' for item in block.items)
+            yield f'<{tag}>{lis}</{tag}>'
+
+
+def iter_headings(blocks):
+    # (tag, id, text) for every heading iter_blocks() emits, in document order.
+    for block in blocks:
+        if block.kind == 'heading':
+            yield block.tag, block.id, block.text
+        elif block.kind == 'card':
+            yield block.heading.tag, block.heading.id, block.heading.text
+            yield from iter_headings(block.children)
+
+
+def render_blocks(blocks, figures=None) -> str:
+    return '\n'.join(iter_blocks(blocks, figures))
+
+
+def body_to_html(body: str, figures=None) -> str:
+    return render_blocks(parse_blocks(body), figures)
+
+
+def iter_indented_blocks(blocks, prefix: str):
+    # Indents block by block, so the page body is never copied as a whole.
+    first = True
+    for block in blocks:
+        indented = '\n'.join(prefix + ln for ln in block.splitlines())
+        if first:
+            first = False
+            yield indented
+        else:
+            yield '\n' + indented
 
 
 def module_filename(module_number: int, lang: str = 'it') -> str:
@@ -321,6 +681,46 @@ def module_filename(module_number: int, lang: str = 'it') -> str:
     return f'module-{module_number:02d}.html'
 
 
+def module_part_filename(module_number: int, lang: str, part: int) -> str:
+    return module_filename(module_number, lang).replace('.html', f'-part-{part + 1:02d}.html')
+
+
+# Markdown characters a section part holds at least before the next h3 may
+# start a new one (an h2 always does).
+PART_MIN_WEIGHT = 12000
+
+
+def block_weight(block) -> int:
+    kind = block.kind
+    if kind in ('paragraph', 'heading'):
+        return len(block.text)
+    if kind == 'table':
+        return sum(map(len, block.header)) + sum(len(cell) for row in block.rows for cell in row)
+    if kind == 'list':
+        return sum(map(len, block.items))
+    if kind == 'card':
+        return sum(map(block_weight, block.children))
+    return 500
+
+
+def module_sections(blocks):
+    # Top-level blocks cut at the outline's section headings. Most modules
+    # have no h2, so h3 headings are cut points too once the current part is
+    # heavy enough; the first part also keeps whatever precedes its heading.
+    sections = [[]]
+    weight = 0
+    opened = False
+    for block in blocks:
+        if block.kind == 'heading' and block.tag != 'h4':
+            if opened and (block.tag == 'h2' or weight >= PART_MIN_WEIGHT):
+                sections.append([])
+                weight = 0
+            opened = True
+        sections[-1].append(block)
+        weight += block_weight(block)
+    return sections
+
+
 def first_teaser(body: str) -> str:
     for raw in body.splitlines():
         line = raw.strip()
@@ -568,6 +968,7 @@ h1 {
 .module-image img {
   width: 100%;
   max-width: 820px;
+  height: auto;
   background: #ffffff;
   box-sizing: border-box;
   padding: 8px;
@@ -717,6 +1118,66 @@ h1 {
   transform: scale(1.03);
 }
 
+.site-search {
+  position: relative;
+  max-width: 560px;
+  margin: 22px auto 0;
+  text-align: left;
+}
+
+.search-input {
+  width: 100%;
+  padding: 11px 16px;
+  border: 1px solid var(--glass-border);
+  border-radius: 999px;
+  background: rgba(255, 255, 255, 0.05);
+  color: var(--text-color);
+  font: inherit;
+  font-size: 0.95rem;
+}
+
+.search-input:focus {
+  outline: none;
+  border-color: var(--accent-secondary);
+  box-shadow: 0 0 0 2px rgba(0, 212, 255, 0.2);
+}
+
+.search-results {
+  position: absolute;
+  top: calc(100% + 6px);
+  left: 0;
+  right: 0;
+  z-index: 1050;
+  list-style: none;
+  max-height: 60vh;
+  overflow-y: auto;
+  padding: 6px;
+  border: 1px solid var(--glass-border);
+  border-radius: 14px;
+  background: rgba(0, 18, 40, 0.97);
+  box-shadow: 0 20px 36px rgba(0, 0, 0, 0.45);
+}
+
+.search-results a {
+  display: block;
+  padding: 8px 10px;
+  border-radius: 10px;
+  color: var(--text-color);
+  text-decoration: none;
+}
+
+.search-results a:hover,
+.search-results a:focus {
+  outline: none;
+  background: rgba(0, 212, 255, 0.12);
+}
+
+.search-result-title { display: block; font-weight: 600; }
+
+.search-result-page { display: block; font-size: 0.8rem; color: var(--text-muted); }
+
+.search-empty { padding: 8px 10px; color: var(--text-muted); }
+
 @media (max-width: 768px) {
   .lang-switch {
     top: 10px;
@@ -755,6 +1216,7 @@ h1 {
 
 @media print {
   .lang-switch,
+  .site-search,
   .to-top-btn,
   .print-btn,
   .module-nav,
@@ -937,138 +1399,166 @@ OUTLINE_STYLE = '''
 OUTLINE_SCRIPT = '''
   <script>
   (() => {
-    const panel = document.querySelector('.outline-panel');
     const host = document.getElementById('outline-nav');
-    const content = document.querySelector('.module-content');
-    if (!panel || !host || !content) return;
-
-    const ordered = Array.from(content.querySelectorAll(
-      'h2.module-section-title, h3.module-subtitle, h4.module-subtitle-small'
-    ));
-    const sections = [];
-    const pendingChildren = [];
-
-    ordered.forEach((heading) => {
-      if (heading.matches('h2.module-section-title, h3.module-subtitle')) {
-        sections.push({ heading, children: [] });
-        return;
-      }
-      if (sections.length === 0) pendingChildren.push(heading);
-      else sections[sections.length - 1].children.push(heading);
+    if (!host) return;
+
+    // The tree is static HTML; the script only tracks the active heading.
+    const links = Array.from(host.querySelectorAll('a.outline-link'));
+    host.querySelectorAll('.outline-section-link').forEach((link) => {
+      link.addEventListener('click', (event) => event.stopPropagation());
     });
 
-    if (sections.length === 0) {
-      const moduleTitle = document.querySelector('.module-title');
-      if (moduleTitle) {
-        sections.push({
-          heading: moduleTitle,
-          children: Array.from(content.querySelectorAll('h4.module-subtitle-small'))
-        });
-      }
-    } else if (pendingChildren.length > 0) {
-      sections[0].children.unshift(...pendingChildren);
-    }
+    if (links.length === 0 || !('IntersectionObserver' in window)) return;
 
-    if (sections.length === 0) {
-      panel.style.display = 'none';
-      return;
-    }
+    const OFFSET = 120;
+    const above = new Set();
+    let activeLink = null;
 
-    const root = document.createElement('ul');
-    root.className = 'outline-root';
-
-    const linkById = new Map();
-    const headingOrder = [];
-
-    sections.forEach((section, index) => {
-      const sectionId = section.heading.id;
-      if (!sectionId) return;
-      headingOrder.push(section.heading);
-
-      const item = document.createElement('li');
-      const details = document.createElement('details');
-      details.className = 'outline-group';
-      details.open = index === 0;
-
-      const summary = document.createElement('summary');
-      const label = document.createElement('span');
-      label.className = 'outline-summary-label';
-      label.textContent = section.heading.textContent.trim();
-
-      const jump = document.createElement('a');
-      jump.className = 'outline-link outline-section-link';
-      jump.href = `#${sectionId}`;
-      jump.textContent = 'Vai';
-      jump.addEventListener('click', (event) => event.stopPropagation());
-
-      summary.append(label, jump);
-      details.appendChild(summary);
-      linkById.set(sectionId, jump);
-
-      if (section.children.length > 0) {
-        const sub = document.createElement('ul');
-        sub.className = 'outline-sublist';
-
-        section.children.forEach((child) => {
-          const childId = child.id;
-          if (!childId) return;
-          headingOrder.push(child);
-
-          const li = document.createElement('li');
-          const link = document.createElement('a');
-          link.className = 'outline-link';
-          link.href = `#${childId}`;
-          link.textContent = child.textContent.trim();
-          li.appendChild(link);
-          sub.appendChild(li);
-          linkById.set(childId, link);
-        });
+    const setActive = () => {
+      const index = above.size > 0 ? Math.max(...above) : 0;
+      const link = links[index];
+      if (link === activeLink) return;
+      if (activeLink) activeLink.classList.remove('active');
+      activeLink = link;
+      link.classList.add('active');
+      const group = link.closest('details.outline-group');
+      if (group) group.open = true;
+    };
 
-        details.appendChild(sub);
-      }
+    // The observed root spans from the top of the document down to OFFSET px
+    // below the top of the viewport, so "intersecting" means "scrolled past":
+    // no layout reads while scrolling, and jumps to an anchor are tracked too.
+    let observer = null;
+    const observe = () => {
+      if (observer) observer.disconnect();
+      // Resolved on every pass: section parts (--split-sections) add headings later.
+      const headings = links.map((link) => document.getElementById(decodeURIComponent(link.hash.slice(1))));
+      headings.forEach((heading, index) => {
+        if (heading) heading.dataset.outlineIndex = String(index);
+      });
+      const lookBehind = document.documentElement.scrollHeight;
+      const bottom = Math.max(window.innerHeight - OFFSET, 0);
+      observer = new IntersectionObserver((entries) => {
+        entries.forEach((entry) => {
+          const index = Number(entry.target.dataset.outlineIndex);
+          if (entry.isIntersecting) above.add(index);
+          else above.delete(index);
+        });
+        setActive();
+      }, { rootMargin: `${lookBehind}px 0px -${bottom}px 0px` });
+      headings.forEach((heading) => {
+        if (heading) observer.observe(heading);
+      });
+    };
 
-      item.appendChild(details);
-      root.appendChild(item);
+    let resizeTimer = 0;
+    window.addEventListener('resize', () => {
+      window.clearTimeout(resizeTimer);
+      resizeTimer = window.setTimeout(observe, 150);
     });
+    document.addEventListener('module-part-loaded', observe);
+    observe();
+  })();
+  </script>
+'''
 
-    host.replaceChildren(root);
-
-    let ticking = false;
-
-    const setActive = () => {
-      ticking = false;
-      if (headingOrder.length === 0) return;
-
-      let active = headingOrder[0];
-      for (const heading of headingOrder) {
-        if (heading.getBoundingClientRect().top - 120 <= 0) active = heading;
-        else break;
-      }
 
-      linkById.forEach((link) => link.classList.remove('active'));
-      const activeLink = linkById.get(active.id);
-      if (activeLink) {
-        activeLink.classList.add('active');
-        const group = activeLink.closest('details.outline-group');
-        if (group) group.open = true;
+# Sections after the first one of a --split-sections page live in their own
+# files: each placeholder keeps its heading and a plain link, and is replaced by
+# the section body as the reader gets close to it (or follows an anchor into it).
+PART_SCRIPT = '''
+  <script>
+  (() => {
+    const parts = Array.from(document.querySelectorAll('.module-part[data-part-src]'));
+    if (parts.length === 0 || !('fetch' in window)) return;
+    const loading = new Map();
+
+    const load = (part) => {
+      if (!loading.has(part)) {
+        loading.set(part, fetch(part.dataset.partSrc)
+          .then((response) => (response.ok ? response.text() : Promise.reject(new Error(response.statusText))))
+          .then((text) => {
+            const body = new DOMParser().parseFromString(text, 'text/html').querySelector('[data-part-body]');
+            const fallback = part.querySelector('.part-fallback');
+            if (!body || !fallback) return;
+            fallback.replaceWith(...Array.from(body.childNodes, (node) => document.importNode(node, true)));
+            part.removeAttribute('data-part-src');
+            document.dispatchEvent(new CustomEvent('module-part-loaded', { detail: part }));
+          })
+          .catch(() => loading.delete(part)));
       }
+      return loading.get(part);
     };
 
-    const onScroll = () => {
-      if (!ticking) {
-        ticking = true;
-        window.requestAnimationFrame(setActive);
-      }
+    const reveal = () => {
+      const id = decodeURIComponent(location.hash.slice(1));
+      if (!id || document.getElementById(id)) return;
+      Promise.all(parts.map(load)).then(() => {
+        const target = document.getElementById(id);
+        if (target) target.scrollIntoView();
+      });
     };
 
-    window.addEventListener('scroll', onScroll, { passive: true });
-    window.addEventListener('hashchange', setActive);
-    setActive();
+    if ('IntersectionObserver' in window) {
+      const observer = new IntersectionObserver((entries) => {
+        entries.forEach((entry) => {
+          if (!entry.isIntersecting) return;
+          observer.unobserve(entry.target);
+          load(entry.target);
+        });
+      }, { rootMargin: '0px 0px 1500px 0px' });
+      parts.forEach((part) => observer.observe(part));
+    } else {
+      parts.forEach(load);
+    }
+    window.addEventListener('hashchange', reveal);
+    reveal();
   })();
   </script>
 '''
 
 
+MODULE_TITLE_ID = 'module-title'
+
+
+def outline_tree_html(headings, title=None) -> str:
+    # Same tree OUTLINE_SCRIPT used to build in the browser: h2/h3 open a
+    # group, h4 headings nest under the latest group (or the first one when
+    # they come before any group, or under `title`, the module title's
+    # (id, text), when there is no group at all).
+    sections = []
+    pending_children = []
+    for tag, heading_id, text in headings:
+        if tag in ('h2', 'h3'):
+            sections.append((heading_id, text, []))
+        elif sections:
+            sections[-1][2].append((heading_id, text))
+        else:
+            pending_children.append((heading_id, text))
+    if sections and pending_children:
+        sections[0][2][:0] = pending_children
+    elif pending_children and title:
+        sections.append((*title, pending_children))
+
+    items = []
+    for index, (section_id, text, children) in enumerate(sections):
+        sub = ''
+        if children:
+            sub = '<ul class="outline-sublist">' + ''.join(
+                f'<li><a class="outline-link" href="#{child_id}">{html.escape(plain_text(child_text))}</a></li>'
+                for child_id, child_text in children
+            ) + '</ul>'
+        items.append(
+            f'<li><details class="outline-group"{" open" if index == 0 else ""}><summary>'
+            f'<span class="outline-summary-label">{html.escape(plain_text(text))}</span>'
+            f'<a class="outline-link outline-section-link" href="#{section_id}">Vai</a>'
+            f'</summary>{sub}</details></li>'
+        )
+    if not items:
+        return ''
+    return '<ul class="outline-root">\n' + '\n'.join(f'        {item}' for item in items) + '\n      </ul>'
+
+
 def lang_switch_html(lang: str = 'it') -> str:
     selected = {
         'it': ' selected' if lang == 'it' else '',
@@ -1164,14 +1654,355 @@ LANG_SWITCH_SCRIPT = '''
 '''
 
 
-def build_home_page(title: str, modules, labs_body: str, bibliography_body: str, home_note_body: str):
-    agenda_items = []
-    for module in modules:
-        num = module['number']
-        item_title = html.escape(module['title'])
-        teaser = first_teaser(module['body'])
+def search_box_html(lang: str = 'it') -> str:
+    is_en = lang == 'en'
+    label = 'Search the course' if is_en else 'Cerca nel corso'
+    empty = 'No results' if is_en else 'Nessun risultato'
+    return f'''
+      <div class="site-search" data-search-index="{SEARCH_INDEX_DIR.as_posix()}/{lang}.json" data-empty="{empty}">
+        <input class="search-input" type="search" placeholder="{label}…" aria-label="{label}" autocomplete="off">
+        <ol class="search-results" hidden></ol>
+      </div>'''
+
+
+SEARCH_SCRIPT = '''
+  <script>
+  (() => {
+    const box = document.querySelector('.site-search');
+    if (!box) return;
+    const input = box.querySelector('.search-input');
+    const list = box.querySelector('.search-results');
+    const MAX_RESULTS = 12;
+    const MAX_EXPANSIONS = 64;
+    let index = null;
+    let loading = null;
+
+    // Same folding as the build: lowercase, strip combining accents.
+    const fold = (value) => value.toLowerCase().normalize('NFD').replace(/\\p{Mn}/gu, '');
+
+    // The index is fetched on first use only, so pages never pay for it up front.
+    const load = () => {
+      if (!loading) {
+        loading = fetch(box.dataset.searchIndex)
+          .then((response) => response.json())
+          .then((data) => { index = data; })
+          .catch(() => { loading = null; });
+      }
+      return loading;
+    };
+
+    const lowerBound = (value) => {
+      let lo = 0;
+      let hi = index.terms.length;
+      while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (index.terms[mid] < value) lo = mid + 1;
+        else hi = mid;
+      }
+      return lo;
+    };
+
+    // Terms are sorted, so every term starting with `prefix` sits in one run
+    // ('{' sorts right after 'z').
+    const match = (prefix) => {
+      const scores = new Map();
+      const start = lowerBound(prefix);
+      const end = Math.min(lowerBound(`${prefix}{`), start + MAX_EXPANSIONS);
+      for (let t = start; t < end; t += 1) {
+        const boost = index.terms[t] === prefix ? 2 : 1;
+        const postings = index.postings[t];
+        let doc = 0;
+        for (let i = 0; i < postings.length; i += 2) {
+          doc += postings[i];
+          scores.set(doc, Math.max(scores.get(doc) || 0, postings[i + 1] * boost));
+        }
+      }
+      return scores;
+    };
+
+    const search = (query) => {
+      const terms = (fold(query).match(/[a-z0-9]+/g) || []).filter((term) => term.length >= 2);
+      if (terms.length === 0) return null;
+      let total = null;
+      for (const term of terms) {
+        const scores = match(term);
+        if (total === null) {
+          total = scores;
+        } else {
+          const next = new Map();
+          total.forEach((score, doc) => {
+            if (scores.has(doc)) next.set(doc, score + scores.get(doc));
+          });
+          total = next;
+        }
+        if (total.size === 0) break;
+      }
+      return Array.from(total).sort((a, b) => b[1] - a[1] || a[0] - b[0]).slice(0, MAX_RESULTS);
+    };
+
+    const render = (results) => {
+      if (results === null) {
+        list.hidden = true;
+        list.replaceChildren();
+        return;
+      }
+      const items = results.map(([doc]) => {
+        const [page, id, heading] = index.docs[doc];
+        const [file, label] = index.pages[page];
+        const item = document.createElement('li');
+        const link = document.createElement('a');
+        link.href = id ? `${file}#${id}` : file;
+        const title = document.createElement('span');
+        title.className = 'search-result-title';
+        title.textContent = heading || label;
+        const where = document.createElement('span');
+        where.className = 'search-result-page';
+        where.textContent = label;
+        link.append(title, where);
+        item.appendChild(link);
+        return item;
+      });
+      if (items.length === 0) {
+        const empty = document.createElement('li');
+        empty.className = 'search-empty';
+        empty.textContent = box.dataset.empty;
+        items.push(empty);
+      }
+      list.replaceChildren(...items);
+      list.hidden = false;
+    };
+
+    input.addEventListener('focus', load, { once: true });
+    input.addEventListener('input', () => {
+      const query = input.value;
+      load().then(() => {
+        if (index && input.value === query) render(search(query));
+      });
+    });
+    input.addEventListener('keydown', (event) => {
+      if (event.key !== 'Escape') return;
+      input.value = '';
+      render(null);
+    });
+  })();
+  </script>
+'''
+
+
+FONTS_HEAD = '''  <link rel="preconnect" href="https://fonts.googleapis.com">
+  <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+  <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;800&family=Outfit:wght@300;500;700&display=swap" rel="stylesheet">'''
+
+
+# Rules kept inline with --critical-css: enough to paint the page frame
+# before the external stylesheet arrives.
+CRITICAL_SELECTORS = {':root', '*', 'html', 'body', '.container', 'header', 'h1', '.subtitle', '.card'}
+SITE_ASSET_RE = re.compile(r'^(site|outline|lang-switch|search|parts)\.[0-9a-f]{10}\.(css|js)$')
+
+
+def _indent(fragment: str, prefix: str) -> str:
+    return chr(10).join(prefix + ln for ln in fragment.splitlines())
+
+
+def _css_rules(css: str):
+    depth = 0
+    start = 0
+    for pos, ch in enumerate(css):
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                rule = css[start:pos + 1].strip()
+                yield rule.split('{', 1)[0].strip(), rule
+                start = pos + 1
+
+
+def critical_css(css: str = STYLE) -> str:
+    return '\n' + '\n'.join(rule for selector, rule in _css_rules(css) if selector in CRITICAL_SELECTORS) + '\n'
+
+
+def _script_source(script_tag: str) -> str:
+    return script_tag.strip().removeprefix('<script>').removesuffix('</script>').strip('\n') + '\n'
+
+
+def site_assets():
+    # Content-hashed names: a file never changes once published, so it can be
+    # served with a long-lived immutable Cache-Control header.
+    assets = {}
+    for key, stem, ext, content in (
+        ('site_css', 'site', 'css', STYLE.lstrip('\n')),
+        ('outline_css', 'outline', 'css', OUTLINE_STYLE.lstrip('\n')),
+        ('outline_js', 'outline', 'js', _script_source(OUTLINE_SCRIPT)),
+        ('lang_switch_js', 'lang-switch', 'js', _script_source(LANG_SWITCH_SCRIPT)),
+        ('search_js', 'search', 'js', _script_source(SEARCH_SCRIPT)),
+        ('parts_js', 'parts', 'js', _script_source(PART_SCRIPT)),
+    ):
+        assets[key] = (f'assets/{stem}.{_digest(content)[:10]}.{ext}', content)
+    return assets
+
+
+def write_site_assets(assets):
+    written = []
+    for path, content in assets.values():
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if write_if_changed(target, content):
+            written.append(path)
+    prune_site_assets(assets)
+    return written
+
+
+def prune_site_assets(assets=None):
+    # Hashed files of earlier builds, or of every build once --external-assets
+    # is off again, with their precompressed siblings.
+    current = {Path(path).name for path, _ in (assets or {}).values()}
+    for stale in SITE_ASSETS_DIR.glob('*.*.*'):
+        name = stale.name
+        if stale.suffix in ('.gz', '.br'):
+            name = stale.with_suffix('').name
+        if SITE_ASSET_RE.match(name) and name not in current:
+            stale.unlink()
+
+
+def _stylesheet_tag(href: str, deferred: bool) -> str:
+    if not deferred:
+        return f'  <link rel="stylesheet" href="{href}">'
+    return (
+        f'  <link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+        f'  <noscript><link rel="stylesheet" href="{href}"></noscript>'
+    )
+
+
+@dataclass
+class BuildOptions:
+    external_assets: bool = False
+    critical_css: bool = False
+    optimize_images: bool = False
+    split_sections: bool = False
+    service_worker: bool = False
+
+    def digest(self) -> str:
+        return _digest(json.dumps(asdict(self), sort_keys=True))
+
+
+class RenderContext:
+    # Everything that is identical across pages is rendered once per
+    # regenerate() call; page builders only add the module's own body.
+
+    def __init__(self, title: str, modules, labs_body: str, bibliography_body: str = '', home_note_body: str = '',
+                 en_translations=None, options: BuildOptions = None, images=None, dimensions=None, tree=None):
+        self.options = options or BuildOptions()
+        self.title = title
+        self.modules = modules
+        self.en_translations = en_translations or {}
+        # Every renderer walks this tree; the markdown bodies are not read again.
+        self.tree = tree or build_course_tree(
+            (title, modules, labs_body, bibliography_body, home_note_body, self.en_translations)
+        )
+        self.translated = {node.number: node for node in self.tree.translations}
+
+        self.figures = FigureRenderer(images, dimensions)
+        # Labs sit below the module body (and the agenda on the home page): never eager.
+        self.labs_html = render_blocks(self.tree.labs, self.figures.for_page(eager=0)) if self.tree.labs else ''
+        self.lang_switch = {lang: lang_switch_html(lang) for lang in ('it', 'en')}
+        self.search_box = {lang: search_box_html(lang) for lang in SEARCH_LANGS}
+        self.assets = site_assets() if self.options.external_assets else {}
+        if self.assets:
+            deferred = self.options.critical_css
+            critical = f'\n  <style>{critical_css()}</style>' if deferred else ''
+            self.home_head = f'{FONTS_HEAD}{critical}\n' + _stylesheet_tag(self.assets['site_css'][0], deferred)
+            self.module_head = f'{self.home_head}\n' + _stylesheet_tag(self.assets['outline_css'][0], deferred)
+            self.lang_switch_script = f'\n  <script src="{self.assets["lang_switch_js"][0]}" defer></script>\n'
+            self.outline_script = f'\n  <script src="{self.assets["outline_js"][0]}" defer></script>\n'
+            self.search_script = f'\n  <script src="{self.assets["search_js"][0]}" defer></script>\n'
+            self.part_script = f'\n  <script src="{self.assets["parts_js"][0]}" defer></script>\n'
+        else:
+            self.home_head = f'{FONTS_HEAD}\n  <style>{STYLE}</style>'
+            self.module_head = f'{self.home_head}\n  <style>{OUTLINE_STYLE}</style>'
+            self.lang_switch_script = LANG_SWITCH_SCRIPT
+            self.outline_script = OUTLINE_SCRIPT
+            self.search_script = SEARCH_SCRIPT
+            self.part_script = PART_SCRIPT
+        self.service_worker_script = SERVICE_WORKER_REGISTER_SCRIPT if self.options.service_worker else ''
+        self.jump_links = {
+            lang: [self._jump_link(m, m['title'], lang) for m in modules]
+            for lang in ('it', 'en')
+        }
+        self.module_labs_section = ''
+        if self.labs_html:
+            self.module_labs_section = f'''
+        <section class="module-content labs-section">
+          <h3 class="module-subtitle">Labs</h3>
+{_indent(self.labs_html, '          ')}
+        </section>
+'''
+
+    @classmethod
+    def from_course(cls, course, options: BuildOptions = None, images=None, dimensions=None, tree=None):
+        title, modules, labs_body, bibliography_body, home_note_body, en_translations = course
+        return cls(
+            title, modules, labs_body, bibliography_body, home_note_body, en_translations, options, images, dimensions,
+            tree,
+        )
+
+    def module_node(self, idx: int, lang: str = 'it') -> Module:
+        if lang == 'en':
+            return self.translated[self.modules[idx]['number']]
+        return self.tree.modules[idx]
+
+    @staticmethod
+    def _jump_link(module, label: str, lang: str) -> str:
+        # Only module 01 has an English page, so EN pages link to it and fall back to IT elsewhere.
+        target_lang = 'en' if (lang == 'en' and module['number'] == 1) else 'it'
+        return (
+            f'<a class="nav-btn" href="{module_filename(module["number"], target_lang)}">'
+            f'{module["number"]:02d} - {html.escape(label)}'
+            '</a>'
+        )
+
+    def jump_nav(self, idx: int, lang: str, translated_module=None) -> str:
+        links = self.jump_links[lang]
+        if lang == 'en' and translated_module:
+            links = list(links)
+            links[idx] = self._jump_link(self.modules[idx], translated_module['title'], lang)
+        return ''.join(links)
+
+
+def iter_blocks_html(blocks, prefix: str, figures=None):
+    return iter_indented_blocks(iter_blocks(blocks, figures), prefix)
+
+
+def iter_home_page(ctx: RenderContext):
+    title = ctx.title
+    yield f'''<!DOCTYPE html>
+<html lang="it">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>{html.escape(title)}</title>
+{ctx.home_head}
+</head>
+<body>
+{ctx.lang_switch['it']}
+  <div class="container">
+    <header>
+      <p class="subtitle">Corso di Alta Formazione</p>
+      <h1>{html.escape(title)}</h1>{ctx.search_box['it']}
+    </header>
+
+    <main>
+      <section class="card">
+        <h2 class="section-title">Indice Moduli</h2>
+        <ul class="agenda-list">
+          '''
+
+    for module in ctx.tree.modules:
+        num = module.number
+        item_title = html.escape(module.title)
+        teaser = module.teaser
         teaser_html = f'<p class="agenda-teaser">{format_inline(teaser)}</p>' if teaser else ''
-        agenda_items.append(
+        yield (
             '<li class="agenda-item">'
             f'<a class="agenda-link" href="{module_filename(num)}">'
             f'<span class="agenda-number">{num:02d}</span>'
@@ -1183,82 +2014,60 @@ def build_home_page(title: str, modules, labs_body: str, bibliography_body: str,
             '</li>'
         )
 
-    labs_section = ''
-    if labs_body:
-        labs_html = body_to_html(labs_body)
-        labs_section = f'''
+    yield '''
+        </ul>
+      </section>
+'''
+
+    if ctx.labs_html:
+        yield f'''
       <section class="card labs-section">
         <h2 class="section-title">Labs</h2>
         <section class="module-content">
-{chr(10).join('          ' + ln for ln in labs_html.splitlines())}
+{_indent(ctx.labs_html, '          ')}
         </section>
       </section>
 '''
+    yield '\n'
 
-    bibliography_section = ''
-    if bibliography_body:
-        bibliography_html = body_to_html(bibliography_body)
-        bibliography_section = f'''
+    if ctx.tree.bibliography:
+        yield '''
       <section class="card">
         <h2 class="section-title">Bibliografia</h2>
         <section class="module-content">
-{chr(10).join('          ' + ln for ln in bibliography_html.splitlines())}
+'''
+        yield from iter_blocks_html(ctx.tree.bibliography, '          ', ctx.figures.for_page(eager=0))
+        yield '''
         </section>
       </section>
 '''
+    yield '\n'
 
-    home_note_html = ''
-    if home_note_body:
-        note_html = body_to_html(home_note_body)
-        home_note_html = f'''
+    if ctx.tree.home_note:
+        yield '''
       <section class="site-footnote">
-{chr(10).join('        ' + ln for ln in note_html.splitlines())}
+'''
+        yield from iter_blocks_html(ctx.tree.home_note, '        ', ctx.figures.for_page(eager=0))
+        yield '''
       </section>
 '''
 
-    return f'''<!DOCTYPE html>
-<html lang="it">
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>{html.escape(title)}</title>
-  <link rel="preconnect" href="https://fonts.googleapis.com">
-  <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-  <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;800&family=Outfit:wght@300;500;700&display=swap" rel="stylesheet">
-  <style>{STYLE}</style>
-</head>
-<body>
-{lang_switch_html('it')}
-  <div class="container">
-    <header>
-      <p class="subtitle">Corso di Alta Formazione</p>
-      <h1>{html.escape(title)}</h1>
-    </header>
-
-    <main>
-      <section class="card">
-        <h2 class="section-title">Indice Moduli</h2>
-        <ul class="agenda-list">
-          {''.join(agenda_items)}
-        </ul>
-      </section>
-{labs_section}
-{bibliography_section}
-{home_note_html}
+    yield f'''
     </main>
   </div>
   <button class="to-top-btn" type="button" onclick="window.scrollTo({{top: 0, behavior: 'smooth'}})">↑ Torna su</button>
-{LANG_SWITCH_SCRIPT}
+{ctx.lang_switch_script}
+{ctx.search_script}{ctx.service_worker_script}
 </body>
 </html>
 '''
 
 
-def build_module_page(course_title: str, modules, idx: int, labs_body: str, lang: str = 'it', translated_module=None):
+def iter_module_page(ctx: RenderContext, idx: int, lang: str = 'it', translated_module=None):
+    modules = ctx.modules
     source_module = modules[idx]
     module = translated_module if translated_module else source_module
     num = source_module['number']
-    body_html = body_to_html(module['body'])
 
     is_en = lang == 'en'
     prev_link = module_filename(modules[idx - 1]['number']) if idx > 0 else None
@@ -1268,7 +2077,7 @@ def build_module_page(course_title: str, modules, idx: int, labs_body: str, lang
     next_label = 'Next Module' if is_en else 'Modulo Successivo'
     module_label = 'Module' if is_en else 'Modulo'
     page_lang = 'en' if is_en else 'it'
-    header_subtitle = 'Designing and Managing AI Solutions' if is_en else course_title
+    header_subtitle = 'Designing and Managing AI Solutions' if is_en else ctx.title
 
     nav_links = [f'<a class="nav-btn" href="index.html">{home_label}</a>']
     if prev_link:
@@ -1276,114 +2085,2152 @@ def build_module_page(course_title: str, modules, idx: int, labs_body: str, lang
     if next_link:
         nav_links.append(f'<a class="nav-btn" href="{next_link}">{next_label}</a>')
 
-    jump_links = [
-        (
-            f'<a class="nav-btn" href="{module_filename(m["number"], "en" if (is_en and m["number"] == 1) else "it")}">'
-            f'{m["number"]:02d} - {html.escape(module["title"] if (is_en and m["number"] == num and translated_module) else m["title"])}'
-            '</a>'
-        )
-        for m in modules
-    ]
-
-    labs_section = ''
-    if labs_body:
-        labs_html = body_to_html(labs_body)
-        labs_section = f'''
-        <section class="module-content labs-section">
-          <h3 class="module-subtitle">Labs</h3>
-{chr(10).join('          ' + ln for ln in labs_html.splitlines())}
-        </section>
-'''
-
-    has_outline = True
+    blocks = ctx.module_node(idx, lang).blocks
+    sections = module_sections(blocks) if ctx.options.split_sections else [blocks]
+    headings = list(iter_headings(blocks))
+    # Only h4 headings: they are grouped under the module title, which then needs an anchor.
+    title_anchored = bool(headings) and all(tag == 'h4' for tag, _, _ in headings)
+    outline_tree = outline_tree_html(headings, (MODULE_TITLE_ID, module['title']))
+    has_outline = bool(outline_tree)
     outline_title = 'Module Structure' if is_en else 'Struttura del modulo'
     outline_html = f'''
   <aside class="outline-panel" aria-label="{outline_title}">
     <div class="outline-frame">
       <p class="outline-title">{outline_title}</p>
-      <nav id="outline-nav" class="outline-nav-tree"></nav>
+      <nav id="outline-nav" class="outline-nav-tree">
+      {outline_tree}
+      </nav>
     </div>
   </aside>
-'''
-    outline_style_tag = f'\n  <style>{OUTLINE_STYLE}</style>'
+''' if has_outline else ''
 
-    return f'''<!DOCTYPE html>
+    yield f'''<!DOCTYPE html>
 <html lang="{page_lang}">
 <head>
   <meta charset="UTF-8">
   <meta name="viewport" content="width=device-width, initial-scale=1.0">
   <title>{module_label} {num:02d} - {html.escape(module['title'])}</title>
-  <link rel="preconnect" href="https://fonts.googleapis.com">
-  <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-  <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;800&family=Outfit:wght@300;500;700&display=swap" rel="stylesheet">
-  <style>{STYLE}</style>{outline_style_tag}
+{ctx.module_head}
 </head>
 <body class="{'has-outline' if has_outline else ''}">
-{lang_switch_html(lang)}
+{ctx.lang_switch[lang]}
 {outline_html}
   <div class="container">
     <header>
       <p class="subtitle">{html.escape(header_subtitle)}</p>
-      <h1>{module_label} {num:02d}</h1>
+      <h1>{module_label} {num:02d}</h1>{ctx.search_box[lang]}
     </header>
 
     <main>
       <article class="card">
         <nav class="module-nav">{''.join(nav_links)}</nav>
-        <nav class="jump-nav">{''.join(jump_links)}</nav>
+        <nav class="jump-nav">{ctx.jump_nav(idx, lang, translated_module)}</nav>
 
         <p class="module-kicker">{module_label} {num:02d}</p>
-        <h2 class="module-title">{html.escape(module['title'])}</h2>
+        <h2{f' id="{MODULE_TITLE_ID}"' if title_anchored else ''} class="module-title">{html.escape(module['title'])}</h2>
 
         <section class="module-content">
-{chr(10).join('          ' + ln for ln in body_html.splitlines())}
+'''
+    yield from iter_indented_blocks(iter_blocks(sections[0], ctx.figures.for_page()), '          ')
+    read_on = 'Continue reading' if is_en else 'Continua a leggere'
+    for part, section in enumerate(sections[1:], 1):
+        href = module_part_filename(num, lang, part)
+        yield '\n' + _indent(
+            f'<section class="module-part" data-part-src="{href}">\n'
+            f'  {next(iter_blocks(section[:1]))}\n'
+            f'  <p class="part-fallback"><a href="{href}">{read_on}: {format_inline(section[0].text)}</a></p>\n'
+            '</section>',
+            '          ',
+        )
+    yield f'''
         </section>
 
-{labs_section}
+{ctx.module_labs_section}
         <nav class="module-nav footer-nav">{''.join(nav_links)}</nav>
       </article>
     </main>
   </div>
   <button class="to-top-btn" type="button" onclick="window.scrollTo({{top: 0, behavior: 'smooth'}})">↑ Torna su</button>
   <button class="print-btn" type="button" onclick="window.print()">{'Print' if is_en else 'Stampa'}</button>
-{LANG_SWITCH_SCRIPT}
-{OUTLINE_SCRIPT if has_outline else ''}
+{ctx.lang_switch_script}
+{ctx.search_script}
+{ctx.outline_script if has_outline else ''}{ctx.part_script if len(sections) > 1 else ''}{ctx.service_worker_script}
 </body>
 </html>
 '''
 
 
-def regenerate():
-    markdown = COURSE_MD.read_text(encoding='utf-8')
-    title, modules, labs_body, bibliography_body, home_note_body, en_translations = parse_course(markdown)
-    if not title:
-        raise SystemExit('Missing course title in course.md')
-    if not modules:
-        raise SystemExit('No modules found in course.md (expected headings like: ## Modulo 01: Titolo)')
+def iter_module_part_page(ctx: RenderContext, idx: int, part: int, lang: str = 'it', translated_module=None):
+    # One section of a --split-sections module as a page of its own: fetched
+    # by PART_SCRIPT (which only takes the [data-part-body] content) and
+    # linked from the placeholder for readers without JavaScript.
+    source_module = ctx.modules[idx]
+    module = translated_module if translated_module else source_module
+    num = source_module['number']
+    is_en = lang == 'en'
+    module_label = 'Module' if is_en else 'Modulo'
+    sections = module_sections(ctx.module_node(idx, lang).blocks)
+    heading, *section = sections[part]
+
+    nav_links = [f'<a class="nav-btn" href="{module_filename(num, lang)}">{module_label} {num:02d}</a>']
+    if part > 1:
+        label = 'Previous Section' if is_en else 'Sezione Precedente'
+        nav_links.append(f'<a class="nav-btn" href="{module_part_filename(num, lang, part - 1)}">{label}</a>')
+    if part < len(sections) - 1:
+        label = 'Next Section' if is_en else 'Sezione Successiva'
+        nav_links.append(f'<a class="nav-btn" href="{module_part_filename(num, lang, part + 1)}">{label}</a>')
+
+    yield f'''<!DOCTYPE html>
+<html lang="{lang}">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>{module_label} {num:02d} - {html.escape(plain_text(heading.text))}</title>
+{ctx.module_head}
+</head>
+<body>
+  <div class="container">
+    <header>
+      <p class="subtitle">{html.escape(module['title'])}</p>
+      <h1>{module_label} {num:02d}</h1>
+    </header>
+
+    <main>
+      <article class="card">
+        <nav class="module-nav">{''.join(nav_links)}</nav>
+
+        <section class="module-content">
+{_indent(next(iter_blocks([heading])), '          ')}
+          <div data-part-body>
+'''
+    # Never eager: in the module page these figures are far below the fold.
+    yield from iter_indented_blocks(iter_blocks(section, ctx.figures.for_page(eager=0)), '          ')
+    yield f'''
+          </div>
+        </section>
+
+        <nav class="module-nav footer-nav">{''.join(nav_links)}</nav>
+      </article>
+    </main>
+  </div>{ctx.service_worker_script}
+</body>
+</html>
+'''
+
+
+FULL_COURSE_STYLE = '''
+.course-toc { margin-bottom: 28px; }
+.course-toc ol { margin-left: 22px; }
+.course-toc > ol > li { margin-top: 8px; font-weight: 600; }
+.course-toc ol ol { font-weight: 400; font-size: 0.92rem; }
+.course-toc a { color: var(--text-color); text-decoration: none; }
+.course-toc a:hover { color: var(--accent-secondary); }
+.course-module { margin-top: 28px; }
+
+@page { size: A4; margin: 16mm 14mm; }
+
+@media print {
+  body { font-size: 10.5pt; }
+  header { padding: 0 0 12pt; }
+  h1 { -webkit-text-fill-color: #000000; background: none; color: #000000; }
+  .container { max-width: none; padding: 0; }
+  .course-module { break-before: page; margin-top: 0; }
+  .course-module .module-content,
+  .course-module .module-content *,
+  .course-toc,
+  .course-toc * { color: #000000 !important; }
+  h2, h3, h4 { break-after: avoid; }
+  figure, table, .quick-card, .checklist-card { break-inside: avoid; }
+  .module-image img { max-height: 180mm; width: auto; max-width: 100%; }
+}
+'''
+
+# Lazy figures are forced in before printing, so the PDF never has holes.
+FULL_COURSE_SCRIPT = '''
+  <script>
+  window.addEventListener('beforeprint', () => {
+    document.querySelectorAll('img[loading="lazy"]').forEach((img) => { img.loading = 'eager'; });
+  });
+  </script>
+'''
+
+FULL_COURSE_REF_RE = re.compile(r'(\s(?:id|href)=")([^"]*)"')
+MODULE_PAGE_RE = re.compile(r'^module-(\d+)\.html(?:#(.*))?$')
+MODULE_PART_RE = re.compile(r'^module-\d+(?:-en)?-part-\d+\.html$')
+
 
-    HOME_HTML.write_text(build_home_page(title, modules, labs_body, bibliography_body, home_note_body), encoding='utf-8')
+def module_anchor(number: int) -> str:
+    return f'm{number:02d}'
+
+
+def rewrite_full_course_refs(chunks, prefix: str, numbers):
+    # Every module keeps its own ids behind a per-module prefix, and links to
+    # module pages that are part of the document become in-page anchors.
+    def _rewrite(match):
+        attr, value = match.group(1), match.group(2)
+        if attr.endswith('id="'):
+            value = f'{prefix}-{value}'
+        elif value.startswith('#'):
+            value = f'#{prefix}-{value[1:]}'
+        else:
+            page = MODULE_PAGE_RE.match(value)
+            if page and int(page.group(1)) in numbers:
+                anchor = module_anchor(int(page.group(1)))
+                value = f'#{anchor}-{page.group(2)}' if page.group(2) else f'#{anchor}'
+        return f'{attr}{value}"'
+
+    for chunk in chunks:
+        yield FULL_COURSE_REF_RE.sub(_rewrite, chunk)
+
+
+def full_course_toc(modules) -> str:
+    items = []
+    for module in modules:
+        anchor = module_anchor(module.number)
+        sections = ''.join(
+            f'<li><a href="#{anchor}-{heading_id}">{html.escape(plain_text(text))}</a></li>'
+            for tag, heading_id, text in iter_headings(module.blocks)
+            if tag == 'h2'
+        )
+        items.append(
+            f'<li><a href="#{anchor}">Modulo {module.number:02d} - {html.escape(module.title)}</a>'
+            + (f'<ol>{sections}</ol>' if sections else '')
+            + '</li>'
+        )
+    return '\n'.join(f'          {item}' for item in items)
 
-    generated = ['index.html']
-    for idx, module in enumerate(modules):
-        out = Path(module_filename(module['number'], 'it'))
-        out.write_text(build_module_page(title, modules, idx, labs_body), encoding='utf-8')
-        generated.append(out.name)
 
-    for module_num, translated in sorted(en_translations.items()):
-        idx = next((i for i, m in enumerate(modules) if m['number'] == module_num), None)
-        if idx is None:
+def iter_full_course_page(ctx: RenderContext):
+    # Streamed module by module: only one module's tokens and blocks are
+    # alive at a time, whatever the size of the combined document.
+    title = ctx.title
+    numbers = {module['number'] for module in ctx.modules}
+    yield f'''<!DOCTYPE html>
+<html lang="it">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>{html.escape(title)} - Corso completo</title>
+{ctx.home_head}
+  <style>{FULL_COURSE_STYLE}</style>
+</head>
+<body>
+  <div class="container">
+    <header>
+      <p class="subtitle">Corso completo</p>
+      <h1>{html.escape(title)}</h1>
+    </header>
+
+    <main>
+      <nav class="card course-toc" aria-label="Indice">
+        <h2 class="section-title">Indice</h2>
+        <ol>
+{full_course_toc(ctx.tree.modules)}
+        </ol>
+      </nav>
+'''
+    figures = ctx.figures.for_page()
+    for module in ctx.tree.modules:
+        num = module.number
+        anchor = module_anchor(num)
+        yield f'''
+      <article class="card course-module" id="{anchor}">
+        <p class="module-kicker">Modulo {num:02d}</p>
+        <h2 class="module-title">{html.escape(module.title)}</h2>
+        <section class="module-content">
+'''
+        yield from rewrite_full_course_refs(iter_blocks_html(module.blocks, '          ', figures), anchor, numbers)
+        yield '''
+        </section>
+      </article>
+'''
+
+    for anchor, label, blocks in (('labs', 'Labs', ctx.tree.labs), ('bibliografia', 'Bibliografia', ctx.tree.bibliography)):
+        if not blocks:
+            continue
+        yield f'''
+      <section class="card course-module" id="{anchor}">
+        <h2 class="section-title">{label}</h2>
+        <section class="module-content">
+'''
+        yield from rewrite_full_course_refs(iter_blocks_html(blocks, '          ', figures), anchor, numbers)
+        yield '''
+        </section>
+      </section>
+'''
+
+    yield f'''
+    </main>
+  </div>
+{FULL_COURSE_SCRIPT}{ctx.service_worker_script}
+</body>
+</html>
+'''
+
+
+def find_pdf_renderer():
+    candidates = [os.environ.get('CHROME_BIN')] + list(PDF_RENDERERS)
+    for candidate in candidates:
+        if candidate and shutil.which(candidate):
+            return shutil.which(candidate)
+    return None
+
+
+def export_pdf(source: Path = FULL_COURSE_HTML, target: Path = FULL_COURSE_PDF):
+    renderer = find_pdf_renderer()
+    if renderer is None:
+        raise SystemExit(f'--pdf needs a headless Chrome/Chromium ({", ".join(PDF_RENDERERS)}) on PATH or in CHROME_BIN')
+    tmp = target.with_name(f'.{target.name}.tmp')
+    subprocess.run(
+        [
+            renderer,
+            '--headless',
+            '--disable-gpu',
+            '--no-pdf-header-footer',
+            '--virtual-time-budget=30000',
+            f'--print-to-pdf={tmp.resolve()}',
+            source.resolve().as_uri(),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    os.replace(tmp, target)
+
+
+def build_home_page(ctx: RenderContext) -> str:
+    return ''.join(iter_home_page(ctx))
+
+
+def build_module_page(ctx: RenderContext, idx: int, lang: str = 'it', translated_module=None) -> str:
+    return ''.join(iter_module_page(ctx, idx, lang, translated_module))
+
+
+def _digest(*parts) -> str:
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part.encode('utf-8') if isinstance(part, str) else part)
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def generator_source() -> bytes:
+    return GENERATOR_PATH.read_bytes()
+
+
+@functools.lru_cache(maxsize=None)
+def template_digest() -> str:
+    # The generator source is hashed too, so any code change invalidates every page.
+    return _digest(STYLE, OUTLINE_STYLE, OUTLINE_SCRIPT, LANG_SWITCH_SCRIPT, SEARCH_SCRIPT, generator_source())
+
+
+def input_digests(course, tree: Course, options: BuildOptions = None):
+    title, modules, labs_body, bibliography_body, home_note_body, en_translations = course
+    return {
+        'options': (options or BuildOptions()).digest(),
+        'title': _digest(title),
+        'outline': _digest(*(f"{m['number']}:{m['title']}" for m in modules)),
+        'teasers': _digest(*(module.teaser for module in tree.modules)),
+        'templates': template_digest(),
+        'labs': _digest(labs_body),
+        'bibliography': _digest(bibliography_body),
+        'home_note': _digest(home_note_body),
+        'modules': {str(m['number']): _digest(m['title'], m['body']) for m in modules},
+        'en': {str(num): _digest(t['title'], t['body']) for num, t in en_translations.items()},
+    }
+
+
+def page_digests(inputs):
+    shared = (
+        inputs['options'],
+        inputs.get('images', ''),
+        inputs['title'],
+        inputs['outline'],
+        inputs['templates'],
+        inputs['labs'],
+    )
+    pages = {
+        HOME_HTML.name: _digest(
+            *shared,
+            inputs['bibliography'],
+            inputs['home_note'],
+            inputs['teasers'],
+        ),
+        FULL_COURSE_HTML.name: _digest(
+            *shared,
+            inputs['bibliography'],
+            *(inputs['modules'][key] for key in sorted(inputs['modules'], key=int)),
+        ),
+    }
+    for key, module_hash in inputs['modules'].items():
+        num = int(key)
+        pages[module_filename(num, 'it')] = _digest(*shared, module_hash)
+        if key in inputs['en']:
+            pages[module_filename(num, 'en')] = _digest(*shared, module_hash, inputs['en'][key])
+    return pages
+
+
+def load_manifest(path: Path = BUILD_MANIFEST):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, path: Path = BUILD_MANIFEST):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_if_changed(path, json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    data = content.encode('utf-8')
+    try:
+        if path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    write_atomic(path, data)
+    return True
+
+
+def write_atomic(path: Path, data: bytes):
+    write_chunks_if_changed(path, [data], compare=False)
+
+
+def _file_digest(path: Path):
+    hasher = hashlib.sha256()
+    try:
+        with path.open('rb') as handle:
+            for block in iter(lambda: handle.read(WRITE_BUFFER_SIZE), b''):
+                hasher.update(block)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+
+def digest_chunks(chunks) -> str:
+    hasher = hashlib.sha256()
+    for chunk in chunks:
+        hasher.update(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    return hasher.hexdigest()
+
+
+def write_chunks_if_changed(path: Path, chunks, compare: bool = True) -> bool:
+    # Chunks are streamed through a buffered writer into a temp file next to
+    # the target and renamed over it, so readers (and a crashed worker) never
+    # observe a half-written page. Identical output is discarded, keeping the
+    # existing file and its mtime.
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        hasher = hashlib.sha256()
+        size = 0
+        with open(fd, 'wb', buffering=WRITE_BUFFER_SIZE) as handle:
+            for chunk in chunks:
+                data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                hasher.update(data)
+                size += len(data)
+                handle.write(data)
+        if compare and path.exists() and path.stat().st_size == size and _file_digest(path) == hasher.hexdigest():
+            os.unlink(tmp_name)
+            return False
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+        return True
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def referenced_images(markdown: str):
+    sources = []
+    for line in markdown.splitlines():
+        match = IMAGE_RE.match(line.strip())
+        if not match:
+            continue
+        src = match.group(2).strip()
+        if src and '://' not in src and not src.startswith('data:') and src not in sources:
+            sources.append(src)
+    return sources
+
+
+def _jpeg_size(handle):
+    handle.seek(2)
+    while True:
+        byte = handle.read(1)
+        while byte and byte != b'\xff':
+            byte = handle.read(1)
+        while byte == b'\xff':
+            byte = handle.read(1)
+        if not byte:
+            return None
+        code = byte[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
             continue
-        out = Path(module_filename(module_num, 'en'))
-        out.write_text(
-            build_module_page(title, modules, idx, labs_body, lang='en', translated_module=translated),
-            encoding='utf-8'
+        length = struct.unpack('>H', handle.read(2))[0]
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', handle.read(5)[1:])
+            return width, height
+        handle.seek(length - 2, 1)
+
+
+def _svg_size(head: bytes):
+    match = re.search(rb'<svg\b[^>]*>', head)
+    if not match:
+        return None
+    tag = match.group(0)
+    width = re.search(rb'\swidth="([\d.]+)(?:px)?"', tag)
+    height = re.search(rb'\sheight="([\d.]+)(?:px)?"', tag)
+    if width and height:
+        return round(float(width.group(1))), round(float(height.group(1)))
+    view_box = re.search(rb'\sviewBox="[\d.\-]+[\s,]+[\d.\-]+[\s,]+([\d.]+)[\s,]+([\d.]+)"', tag)
+    if view_box:
+        return round(float(view_box.group(1))), round(float(view_box.group(2)))
+    return None
+
+
+def read_image_size(path: Path):
+    # Reads only the file header; no imaging library needed.
+    try:
+        with path.open('rb') as handle:
+            head = handle.read(32)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+            if head.startswith(b'\xff\xd8'):
+                return _jpeg_size(handle)
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                chunk = head[12:16]
+                if chunk == b'VP8 ':
+                    width, height = struct.unpack('<HH', head[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                if chunk == b'VP8L':
+                    bits = int.from_bytes(head[21:25], 'little')
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b'VP8X':
+                    return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+            if path.suffix.lower() == '.svg':
+                handle.seek(0)
+                return _svg_size(handle.read(4096))
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
+
+
+def load_course(markdown: str, cache_path: Path = PARSE_CACHE, save: bool = True, quiet: bool = False):
+    # parse_course() and the course tree built from it, cached by the hash of
+    # course.md and of the generator itself (a code change is a miss).
+    key = _digest(markdown, generator_source())
+    try:
+        with cache_path.open('rb') as handle:
+            cached = pickle.load(handle)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        cached = None
+    if isinstance(cached, dict) and cached.get('key') == key:
+        course, tree = cached['course'], cached['tree']
+        outcome = 'hit'
+    else:
+        course = parse_course(markdown)
+        tree = build_course_tree(course)
+        outcome = 'miss'
+        if save:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(cache_path, pickle.dumps(
+                {'key': key, 'course': course, 'tree': tree}, protocol=pickle.HIGHEST_PROTOCOL
+            ))
+    if not quiet:
+        print(f'Parse cache {outcome} ({cache_path})')
+    return course, tree
+
+
+def export_course_tree(path: Path, source: Path = None):
+    source = Path(source or COURSE_MD)
+    _, tree = load_course(source.read_text(encoding='utf-8'), quiet=True)
+    data = {'version': 1, 'source': source.as_posix(), 'course': tree.to_json()}
+    write_if_changed(path, json.dumps(data, ensure_ascii=False, indent=2) + '\n')
+    print(f'Course tree written to {path}')
+
+
+def read_image_dimensions(sources, cache_path: Path = IMAGE_HEADER_CACHE, save: bool = True):
+    # Header reads are cached by (size, mtime) so repeated builds stat the
+    # files instead of reopening them.
+    cached = load_manifest(cache_path)
+    fresh = {}
+    dimensions = {}
+    for src in sources:
+        path = Path(src)
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entry = cached.get(src)
+        if not entry or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            size = read_image_size(path)
+            entry = [stat.st_size, stat.st_mtime_ns, *(size or (None, None))]
+        fresh[src] = entry
+        if entry[2] and entry[3]:
+            dimensions[src] = (entry[2], entry[3])
+    if save and fresh != cached:
+        save_manifest(fresh, cache_path)
+    return dimensions
+
+
+def picture_sources(image) -> str:
+    return ''.join(
+        f'<source type="image/{fmt}" srcset="'
+        + ', '.join(f'{html.escape(path, quote=True)} {width}w' for path, width in image['variants'][fmt])
+        + f'" sizes="{IMAGE_SIZES}">'
+        for fmt in IMAGE_FORMATS
+        if image['variants'].get(fmt)
+    )
+
+
+def _load_pillow():
+    try:
+        from PIL import Image, features
+    except ImportError:
+        raise SystemExit('--optimize-images requires Pillow (pip install Pillow)')
+    return Image, features
+
+
+def _encode_variants(src: str, source_hash: str, formats):
+    Image, _ = _load_pillow()
+    path = Path(src)
+    variants = {}
+    with Image.open(path) as image:
+        image.load()
+        width, height = image.size
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        frame = image.convert('RGBA' if has_alpha else 'RGB')
+        targets = sorted({w for w in IMAGE_WIDTHS if w < width} | {min(width, IMAGE_WIDTHS[-1])})
+        resized = {
+            target: frame if target == width else frame.resize((target, round(height * target / width)), Image.LANCZOS)
+            for target in targets
+        }
+        for fmt in formats:
+            entries = []
+            for target, variant in resized.items():
+                out = OPTIMIZED_IMAGES_DIR / f'{path.stem}-{source_hash[:10]}-{target}.{fmt}'
+                if not out.exists():
+                    buffer = io.BytesIO()
+                    variant.save(buffer, fmt.upper(), quality=IMAGE_QUALITY[fmt])
+                    write_atomic(out, buffer.getvalue())
+                entries.append([out.as_posix(), target])
+            variants[fmt] = entries
+    return {'hash': source_hash, 'width': width, 'height': height, 'variants': variants}
+
+
+def optimize_images(sources, jobs: int = 1, encode: bool = True):
+    # Variants are cached by source hash: an unchanged image is never
+    # re-encoded, and variant names embed the hash so they never go stale.
+    # The hash itself is cached by (size, mtime), so a cached build only
+    # stats the sources.
+    _, features = _load_pillow()
+    formats = [fmt for fmt in IMAGE_FORMATS if features.check(fmt)]
+    cached = load_manifest(IMAGE_MANIFEST)
+    images = {}
+    stats = {}
+    pending = []
+
+    for src in sources:
+        path = Path(src)
+        if path.suffix.lower() not in RASTER_IMAGE_SUFFIXES or not path.is_file():
+            continue
+        stat = path.stat()
+        stats[src] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        entry = cached.get(src)
+        if entry and all(entry.get(key) == value for key, value in stats[src].items()):
+            source_hash = entry['hash']
+            entry = {key: value for key, value in entry.items() if key not in stats[src]}
+        else:
+            source_hash = _file_digest(path)
+        if (
+            entry
+            and entry['hash'] == source_hash
+            and sorted(entry['variants']) == sorted(formats)
+            and all(Path(p).exists() for variant in entry['variants'].values() for p, _ in variant)
+        ):
+            images[src] = entry
+        elif encode:
+            pending.append((src, source_hash))
+
+    if pending:
+        OPTIMIZED_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+        # Pillow releases the GIL while resampling and encoding.
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            encoded = pool.map(lambda item: _encode_variants(item[0], item[1], formats), pending)
+            images.update(zip((src for src, _ in pending), encoded))
+
+    if encode:
+        keep = {Path(p).name for entry in images.values() for variant in entry['variants'].values() for p, _ in variant}
+        if OPTIMIZED_IMAGES_DIR.is_dir():
+            for stale in OPTIMIZED_IMAGES_DIR.iterdir():
+                if stale.name not in keep:
+                    stale.unlink()
+        save_manifest({src: {**entry, **stats[src]} for src, entry in images.items()}, IMAGE_MANIFEST)
+    return images
+
+
+REFERENCE_ATTR_RE = re.compile(r'\s(id|href|src|srcset)="([^"]*)"')
+HTML_ID_RE = re.compile(r'\sid="([^"]*)"')
+EXTERNAL_REF_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//)', re.I)
+
+
+class ReferenceCollector:
+    # Collects ids, links and image references from the chunks as they are
+    # streamed to disk, so no page has to be parsed again afterwards.
+
+    def __init__(self):
+        self.ids = set()
+        self.links = set()
+        self.images = set()
+
+    def scan(self, chunks):
+        for chunk in chunks:
+            for attr, value in REFERENCE_ATTR_RE.findall(chunk):
+                value = html.unescape(value)
+                if attr == 'id':
+                    self.ids.add(value)
+                elif attr == 'srcset':
+                    self.images.update(part.split()[0] for part in value.split(',') if part.strip())
+                elif not EXTERNAL_REF_RE.match(value):
+                    (self.images if attr == 'src' else self.links).add(value)
+            yield chunk
+
+    def as_dict(self):
+        return {'ids': sorted(self.ids), 'links': sorted(self.links), 'images': sorted(self.images)}
+
+
+def check_references(references, root: Path = Path('.'), parts=None):
+    page_ids = {name: set(refs['ids']) for name, refs in references.items()}
+    # A split module page and its section parts share one set of anchors:
+    # PART_SCRIPT loads the part holding any anchor that is not there yet.
+    for name, parent in (parts or {}).items():
+        if name in page_ids and parent in page_ids:
+            page_ids[parent] |= page_ids[name]
+    for name, parent in (parts or {}).items():
+        if name in page_ids and parent in page_ids:
+            page_ids[name] = page_ids[parent]
+
+    def _ids_of(target: str):
+        if target not in page_ids:
+            try:
+                page_ids[target] = set(HTML_ID_RE.findall((root / target).read_text(encoding='utf-8')))
+            except (OSError, UnicodeDecodeError):
+                page_ids[target] = set()
+        return page_ids[target]
+
+    broken = []
+    counts = {'images': 0, 'links': 0, 'anchors': 0}
+    for name, refs in sorted(references.items()):
+        for ref in refs['images']:
+            counts['images'] += 1
+            if not (root / unquote(ref.split('#')[0].split('?')[0])).is_file():
+                broken.append({'page': name, 'kind': 'image', 'ref': ref, 'reason': 'missing file'})
+        for ref in refs['links']:
+            counts['links'] += 1
+            target, _, fragment = ref.partition('#')
+            target = unquote(target.split('?')[0]) or name
+            if target not in references and not (root / target).exists():
+                broken.append({'page': name, 'kind': 'link', 'ref': ref, 'reason': 'missing file'})
+            elif fragment and target.endswith('.html'):
+                counts['anchors'] += 1
+                if unquote(fragment) not in _ids_of(target):
+                    broken.append({'page': name, 'kind': 'link', 'ref': ref, 'reason': 'unknown anchor'})
+    return {'pages': len(references), 'checked': counts, 'broken': broken}
+
+
+def update_build_report(section: str, data):
+    report = load_manifest(BUILD_REPORT)
+    report[section] = data
+    save_manifest(report, BUILD_REPORT)
+
+
+# Registered from every page with --service-worker. Not on file:// URLs,
+# where service workers are unavailable.
+SERVICE_WORKER_REGISTER_SCRIPT = '''
+  <script>
+  if ('serviceWorker' in navigator && location.protocol !== 'file:') {
+    window.addEventListener('load', () => navigator.serviceWorker.register('sw.js'));
+  }
+  </script>
+'''
+
+# PRECACHE_MANIFEST maps every page and referenced file to its content hash;
+# an install only downloads the entries whose hash changed since the last one.
+# Pages are served stale-while-revalidate, other precached files cache-first,
+# Google Fonts stale-while-revalidate from a runtime cache.
+SERVICE_WORKER_SOURCE = '''// Generated by scripts/regenerate_index.py --service-worker; do not edit.
+const PRECACHE_MANIFEST = __PRECACHE_MANIFEST__;
+const SCOPE = new URL('./', self.location).pathname;
+const PRECACHE = `precache:${SCOPE}`;
+const RUNTIME = `runtime:${SCOPE}`;
+const REVISIONS = '__precache-revisions__';
+const FONT_ORIGINS = ['https://fonts.googleapis.com', 'https://fonts.gstatic.com'];
+
+self.addEventListener('install', (event) => {
+  event.waitUntil((async () => {
+    const cache = await caches.open(PRECACHE);
+    const stored = await cache.match(REVISIONS);
+    const revisions = stored ? await stored.json() : {};
+    const changed = Object.keys(PRECACHE_MANIFEST).filter((url) => revisions[url] !== PRECACHE_MANIFEST[url]);
+    await Promise.all(changed.map(async (url) => {
+      const response = await fetch(url, { cache: 'reload' });
+      if (!response.ok) throw new Error(`${url}: ${response.status}`);
+      await cache.put(url, response);
+      revisions[url] = PRECACHE_MANIFEST[url];
+    }));
+    await cache.put(REVISIONS, new Response(JSON.stringify(revisions)));
+    await self.skipWaiting();
+  })());
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    const cache = await caches.open(PRECACHE);
+    const keep = new Set([...Object.keys(PRECACHE_MANIFEST), REVISIONS].map((url) => new URL(url, self.location).href));
+    const requests = await cache.keys();
+    await Promise.all(requests.filter((request) => !keep.has(request.url)).map((request) => cache.delete(request)));
+    await self.clients.claim();
+  })());
+});
+
+const staleWhileRevalidate = (event, cacheName, key) => {
+  const network = fetch(event.request).then(async (response) => {
+    if (response.ok || response.type === 'opaque') {
+      const cache = await caches.open(cacheName);
+      await cache.put(key, response.clone());
+    }
+    return response;
+  });
+  event.waitUntil(network.catch(() => undefined));
+  return caches.open(cacheName)
+    .then((cache) => cache.match(key))
+    .then((cached) => cached || network);
+};
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  if (request.method !== 'GET') return;
+  const url = new URL(request.url);
+  if (FONT_ORIGINS.includes(url.origin)) {
+    event.respondWith(staleWhileRevalidate(event, RUNTIME, request));
+    return;
+  }
+  if (url.origin !== self.location.origin || !url.pathname.startsWith(SCOPE)) return;
+  let key = decodeURIComponent(url.pathname.slice(SCOPE.length));
+  if (key === '' || key.endsWith('/')) key += 'index.html';
+  if (!(key in PRECACHE_MANIFEST)) return;
+  if (key.endsWith('.html')) {
+    event.respondWith(staleWhileRevalidate(event, PRECACHE, key));
+    return;
+  }
+  event.respondWith(caches.open(PRECACHE)
+    .then((cache) => cache.match(key))
+    .then((cached) => cached || fetch(request)));
+});
+'''
+
+# Written over sw.js when a build no longer asks for --service-worker, so
+# browsers that installed the old one drop it and its caches.
+SERVICE_WORKER_RETIRED_SOURCE = '''// Generated by scripts/regenerate_index.py; the service worker is disabled.
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    const scope = new URL('./', self.location).pathname;
+    const names = await caches.keys();
+    await Promise.all(names.filter((name) => name.endsWith(`:${scope}`)).map((name) => caches.delete(name)));
+    await self.registration.unregister();
+  })());
+});
+'''
+
+
+def precache_files(generated, references):
+    # Every generated page and side file plus every local file any page
+    # references (figures, hand-written pages, downloads).
+    files = {Path(name) for name, _ in generated if Path(name).suffix in PRECOMPRESS_SUFFIXES}
+    for refs in references.values():
+        for ref in (*refs['images'], *refs['links']):
+            path = _local_reference(ref)
+            if path is not None:
+                files.add(path)
+    files.discard(SERVICE_WORKER)
+    return sorted(path for path in files if path.is_file())
+
+
+def precache_manifest(files, cache_path: Path = SERVICE_WORKER_CACHE, save: bool = True):
+    # Hashes are cached by (size, mtime), like the image headers, so a build
+    # only rereads the files it rewrote.
+    cached = load_manifest(cache_path)
+    fresh = {}
+    manifest = {}
+    for path in files:
+        key = path.as_posix()
+        stat = path.stat()
+        entry = cached.get(key)
+        if not (entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns):
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': _file_digest(path)[:16]}
+        fresh[key] = entry
+        manifest[key] = entry['hash']
+    if save and fresh != cached:
+        save_manifest(fresh, cache_path)
+    return manifest
+
+
+def service_worker_source(manifest) -> str:
+    return SERVICE_WORKER_SOURCE.replace('__PRECACHE_MANIFEST__', json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _load_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def precompress_targets(generated):
+    # Everything the build wrote that a static host serves as text, plus the
+    # hand-made SVGs under assets/.
+    targets = [Path(name) for name, _ in generated if Path(name).suffix in PRECOMPRESS_SUFFIXES]
+    if SITE_ASSETS_DIR.is_dir():
+        targets += sorted(
+            p for p in SITE_ASSETS_DIR.rglob('*.svg') if OPTIMIZED_IMAGES_DIR.name not in p.parts
         )
-        generated.append(out.name)
+    return [path for path in dict.fromkeys(targets) if path.is_file()]
+
+
+def _compress_file(path: Path, brotli) -> dict:
+    source_mtime = path.stat().st_mtime_ns
+    data = None
+    entry = {'bytes': path.stat().st_size, 'written': []}
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        sibling = path.with_name(path.name + suffix)
+        try:
+            fresh = sibling.stat().st_mtime_ns >= source_mtime
+        except OSError:
+            fresh = False
+        if not fresh:
+            if data is None:
+                data = path.read_bytes()
+            if encoding == 'br':
+                compressed = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            write_atomic(sibling, compressed)
+            entry['written'].append(sibling.as_posix())
+        entry[encoding] = sibling.stat().st_size
+        entry[f'{encoding}_ratio'] = round(entry[encoding] / entry['bytes'], 4) if entry['bytes'] else 1.0
+    return entry
+
+
+def _sibling_is_fresh(sibling: Path) -> bool:
+    # A .gz/.br sibling serves its source only while it is not older than it.
+    try:
+        return sibling.stat().st_mtime_ns >= sibling.with_suffix('').stat().st_mtime_ns
+    except OSError:
+        return False
 
-    print(f'Generated {len(generated)} HTML files from {COURSE_MD}:')
-    for name in generated:
-        print(f'- {name}')
+
+def remove_stale_siblings(roots=(Path('.'), SITE_ASSETS_DIR)):
+    # Siblings whose source is gone, or was rewritten by a build without
+    # --precompress.
+    removed = []
+    for root in roots:
+        if not root.is_dir():
+            continue
+        siblings = root.glob('*') if root == Path('.') else root.rglob('*')
+        for sibling in siblings:
+            if sibling.suffix in ('.gz', '.br') and sibling.with_suffix('').suffix in PRECOMPRESS_SUFFIXES:
+                if not _sibling_is_fresh(sibling):
+                    sibling.unlink()
+                    removed.append(sibling.as_posix())
+    return removed
+
+
+def _local_reference(ref: str):
+    path = unquote(ref.split('#')[0].split('?')[0])
+    if not path or EXTERNAL_REF_RE.match(path) or path.startswith('/'):
+        return None
+    path = Path(os.path.normpath(path))
+    return None if path.parts[0] == '..' else path
+
+
+def dist_sources(references):
+    # Root pages (generated and hand-written), every local file any of them
+    # references, the generated side files and DIST_EXTRA_DIRS. Unreferenced
+    # images never reach dist/.
+    pages = sorted(Path('.').glob('*.html'))
+    references = dict(references)
+    for page in pages:
+        if page.name not in references:
+            collector = ReferenceCollector()
+            for _ in collector.scan([page.read_text(encoding='utf-8', errors='replace')]):
+                pass
+            references[page.name] = collector.as_dict()
+    files = set(pages)
+    for refs in references.values():
+        for ref in (*refs['images'], *refs['links']):
+            path = _local_reference(ref)
+            if path is not None and path.is_file():
+                files.add(path)
+    if SEARCH_INDEX_DIR.is_dir():
+        files.update(SEARCH_INDEX_DIR.glob('*.json'))
+    if SERVICE_WORKER.is_file():
+        files.add(SERVICE_WORKER)
+    for directory in DIST_EXTRA_DIRS:
+        if directory.is_dir():
+            files.update(p for p in directory.rglob('*') if p.is_file())
+    # Only siblings at least as new as their source, the rule the preview
+    # server applies: a stale one would be served in place of the new page.
+    files.update(
+        sibling for path in list(files) for _, suffix in PRECOMPRESSED_ENCODINGS
+        for sibling in [path.with_name(path.name + suffix)] if _sibling_is_fresh(sibling)
+    )
+    return sorted(path for path in files if not DIST_EXCLUDED_NAMES.intersection(path.parts))
+
+
+def _place_file(source: Path, target: Path) -> str:
+    # Hardlink first, then a copy-on-write clone, then a plain copy. Pages
+    # and assets are always replaced (never edited in place) by this build,
+    # so a hardlinked dist/ never sees a half-written source.
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f'.{target.name}.tmp')
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp)
+        method = 'linked'
+    except OSError:
+        method = 'copied'
+        with source.open('rb') as src, tmp.open('wb') as dst:
+            try:
+                if fcntl is None:
+                    raise OSError('no FICLONE on this platform')
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                method = 'cloned'
+            except OSError:
+                shutil.copyfileobj(src, dst, WRITE_BUFFER_SIZE)
+        shutil.copystat(source, tmp)
+    os.replace(tmp, target)
+    return method
+
+
+def prepare_dist(dist_dir: Path = DIST_DIR, references=None, quiet: bool = False):
+    # Syncs dist/ against a (size, mtime, hash) manifest: unchanged files
+    # are not touched, changed ones are relinked, vanished ones deleted.
+    if references is None:
+        references = load_manifest().get('references', {})
+    manifest = load_manifest(DIST_MANIFEST)
+    previous = manifest.get('files', {}) if manifest.get('dist') == str(dist_dir.resolve()) else {}
+    files = {}
+    counts = {'unchanged': 0, 'linked': 0, 'cloned': 0, 'copied': 0, 'removed': 0}
+    for source in dist_sources(references):
+        key = source.as_posix()
+        stat = source.stat()
+        target = dist_dir / source
+        entry = previous.get(key)
+        try:
+            target_size = target.stat().st_size
+        except OSError:
+            target_size = None
+        if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns] and target_size == stat.st_size:
+            files[key] = entry
+            counts['unchanged'] += 1
+            continue
+        digest = _file_digest(source)
+        files[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        if entry and entry[2] == digest and target_size == stat.st_size:
+            counts['unchanged'] += 1
+            continue
+        counts[_place_file(source, target)] += 1
+
+    if dist_dir.is_dir():
+        for path in sorted(dist_dir.rglob('*'), reverse=True):
+            relative = path.relative_to(dist_dir).as_posix()
+            if path.is_dir():
+                if not any(path.iterdir()):
+                    path.rmdir()
+            elif relative not in files:
+                path.unlink()
+                counts['removed'] += 1
+    save_manifest({'dist': str(dist_dir.resolve()), 'files': files}, DIST_MANIFEST)
+    if not quiet:
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items() if count)
+        print(f'Synced {len(files)} files to {dist_dir}/: {summary}')
+    return counts
+
+
+def precompress(generated, jobs: int = 1, quiet: bool = False):
+    # A sibling newer than its source is kept as is, so an incremental build
+    # only compresses the files it rewrote.
+    brotli = _load_brotli()
+    if brotli is None and not quiet:
+        print('brotli is not installed; writing .gz siblings only (pip install brotli for .br)')
+    targets = precompress_targets(generated)
+    # zlib and brotli release the GIL while compressing.
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        entries = dict(zip((t.as_posix() for t in targets), pool.map(lambda t: _compress_file(t, brotli), targets)))
+    written = [path for entry in entries.values() for path in entry.pop('written')]
+    totals = {'bytes': sum(entry['bytes'] for entry in entries.values())}
+    for encoding, _ in PRECOMPRESSED_ENCODINGS:
+        if all(encoding in entry for entry in entries.values()) and entries:
+            totals[encoding] = sum(entry[encoding] for entry in entries.values())
+            totals[f'{encoding}_ratio'] = round(totals[encoding] / totals['bytes'], 4) if totals['bytes'] else 1.0
+    update_build_report('compression', {'files': entries, 'totals': totals})
+    return written, remove_stale_siblings()
+
+
+TAG_RE = re.compile(r'<[^>]+>')
+SEARCH_TERM_RE = re.compile(r'[a-z0-9]+')
+SEARCH_TITLE_WEIGHT = 5
+SEARCH_MAX_WEIGHT = 99
+SEARCH_MIN_TERM = 2
+
+
+def plain_text(text: str) -> str:
+    return html.unescape(TAG_RE.sub('', format_inline(text)))
+
+
+def collect_search_sections(blocks, page: str, sections=None, current=None):
+    # One entry per anchor: [page, id, heading, text]. Text before the first
+    # heading belongs to the page itself (empty id).
+    sections = [] if sections is None else sections
+
+    def _open(heading_id: str, heading: str):
+        nonlocal current
+        current = [page, heading_id, heading, []]
+        sections.append(current)
+
+    def _add(*parts):
+        if current is None:
+            _open('', '')
+        current[3].extend(plain_text(part) for part in parts if part)
+
+    for block in blocks:
+        kind = block.kind
+        if kind == 'paragraph':
+            _add(block.text)
+        elif kind == 'heading':
+            _open(block.id, plain_text(block.text))
+        elif kind == 'card':
+            _open(block.heading.id, plain_text(block.heading.text))
+            collect_search_sections(block.children, page, sections, current)
+        elif kind == 'table':
+            _add(*block.header, *(cell for row in block.rows for cell in row))
+        elif kind == 'figure':
+            _add(block.alt, block.caption)
+        elif kind == 'list':
+            _add(*block.items)
+    return sections
+
+
+def search_terms(text: str):
+    return [term for term in SEARCH_TERM_RE.findall(fold_accents(text)) if len(term) >= SEARCH_MIN_TERM]
+
+
+def search_documents(blocks, page: str):
+    # [heading id, heading, {term: weight}] per section of one body.
+    documents = []
+    for _, heading_id, heading, texts in collect_search_sections(blocks, page):
+        weights = {}
+        for term in search_terms(heading):
+            weights[term] = weights.get(term, 0) + SEARCH_TITLE_WEIGHT
+        for text in texts:
+            for term in search_terms(text):
+                weights[term] = weights.get(term, 0) + 1
+        documents.append([heading_id, heading, {term: min(weight, SEARCH_MAX_WEIGHT) for term, weight in weights.items()}])
+    return documents
+
+
+def build_search_index(pages, documents):
+    # Terms are stored sorted: every prefix maps to one contiguous run, so the
+    # client walks the trie with two binary searches instead of a nested
+    # object. Postings are flat [doc delta, weight, ...] lists.
+    page_numbers = {name: number for number, (name, _) in enumerate(pages)}
+    docs = []
+    postings = {}
+    last_doc = {}
+    for doc, (page, heading_id, heading, weights) in enumerate(documents):
+        docs.append([page_numbers[page], heading_id, heading])
+        for term, weight in weights.items():
+            encoded = postings.get(term)
+            if encoded is None:
+                postings[term] = [doc, weight]
+            else:
+                encoded += (doc - last_doc[term], weight)
+            last_doc[term] = doc
+    terms = sorted(postings)
+    flat = [postings[term] for term in terms]
+    return {'version': 1, 'pages': [list(page) for page in pages], 'docs': docs, 'terms': terms, 'postings': flat}
+
+
+def search_digests(inputs):
+    # One digest per shard, so an edit to an Italian module leaves en.json alone.
+    return {
+        'it': _digest(
+            inputs['title'], inputs['templates'], inputs['labs'], inputs['bibliography'],
+            json.dumps(inputs['modules'], sort_keys=True),
+        ),
+        'en': _digest(inputs['title'], inputs['templates'], json.dumps(inputs['en'], sort_keys=True)),
+    }
+
+
+def search_indexes(tree: Course, inputs, langs=SEARCH_LANGS, cache_path: Path = SEARCH_CACHE, save: bool = True):
+    # Each page's documents are cached by its name and input digest, so an
+    # edit only re-extracts the sections of the module that changed.
+    # Pickled, like the parse cache: indented JSON of every term dict costs
+    # more than the extraction it saves.
+    cached = {}
+    if cache_path:
+        try:
+            with cache_path.open('rb') as handle:
+                cached = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            cached = {}
+    if not isinstance(cached, dict) or cached.get('generator') != template_digest():
+        cached = {}
+    fresh = {'generator': template_digest()}
+    fresh.update((lang, cached[lang]) for lang in SEARCH_LANGS if lang not in langs and lang in cached)
+
+    def _documents(lang: str, blocks, page: str, digest: str):
+        key = _digest(page, digest)
+        documents = cached.get(lang, {}).get(key)
+        if documents is None:
+            documents = search_documents(blocks, page)
+        fresh.setdefault(lang, {})[key] = documents
+        return [[page, *document] for document in documents]
+
+    home = (HOME_HTML.name, tree.title)
+    indexes = {}
+    if 'it' in langs:
+        pages = [home]
+        documents = []
+        for module in tree.modules:
+            name = module_filename(module.number)
+            pages.append((name, f'{module.number:02d} - {module.title}'))
+            documents += _documents('it', module.blocks, name, inputs['modules'][str(module.number)])
+        # Labs and bibliography are searched once, on the home page that hosts them.
+        for key in ('labs', 'bibliography'):
+            blocks = getattr(tree, key)
+            if blocks:
+                documents += _documents('it', blocks, HOME_HTML.name, inputs[key])
+        indexes['it'] = build_search_index(pages, documents)
+    if 'en' in langs:
+        pages = [home]
+        documents = []
+        for translated in sorted(tree.translations, key=lambda node: node.number):
+            name = module_filename(translated.number, 'en')
+            pages.append((name, f'{translated.number:02d} - {translated.title}'))
+            documents += _documents('en', translated.blocks, name, inputs['en'][str(translated.number)])
+        indexes['en'] = build_search_index(pages, documents)
+    if save and cache_path:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(cache_path, pickle.dumps(fresh, protocol=pickle.HIGHEST_PROTOCOL))
+    return {
+        (SEARCH_INDEX_DIR / f'{lang}.json').as_posix(): json.dumps(index, ensure_ascii=False, separators=(',', ':')) + '\n'
+        for lang, index in indexes.items()
+    }
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'category', 'start')
+
+    def __init__(self, profiler, name: str, category: str):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.events.append((self.name, self.category, self.start, time.perf_counter(), os.getpid()))
+        return False
+
+
+class Profiler:
+    # Named spans for --profile. While disabled, span() returns one shared
+    # null context, so instrumented code pays a method call and nothing else.
+
+    _NULL_SPAN = contextlib.nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def span(self, name: str, category: str = 'phase'):
+        if not self.enabled:
+            return self._NULL_SPAN
+        return _Span(self, name, category)
+
+    def drain(self):
+        events, self.events = self.events, []
+        return events
+
+    def table(self) -> str:
+        totals = {}
+        for name, category, start, end, _ in self.events:
+            entry = totals.setdefault((category, name), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += end - start
+            entry[2] = max(entry[2], end - start)
+        rows = [f'{"span":<44} {"kind":<6} {"calls":>5} {"total ms":>10} {"max ms":>9}']
+        for (category, name), (calls, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            rows.append(f'{name:<44} {category:<6} {calls:>5} {total * 1000:>10.2f} {longest * 1000:>9.2f}')
+        return '\n'.join(rows)
+
+    def write_trace(self, path: Path):
+        # Chrome trace-event format: open in chrome://tracing or ui.perfetto.dev.
+        origin = min((start for _, _, start, _, _ in self.events), default=0.0)
+        trace = [
+            {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - origin) * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': pid,
+                'tid': pid,
+            }
+            for name, category, start, end, pid in self.events
+        ]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({'traceEvents': trace, 'displayTimeUnit': 'ms'}) + '\n', encoding='utf-8')
+
+
+PROFILER = Profiler()
+
+
+def plan_pages(tree: Course, full_course: bool = False, split_sections: bool = False):
+    plan = {HOME_HTML.name: ('home', None, None)}
+
+    def _add_module(idx: int, lang: str, module: Module):
+        plan[module_filename(module.number, lang)] = ('module', idx, lang)
+        if split_sections:
+            for part in range(1, len(module_sections(module.blocks))):
+                plan[module_part_filename(module.number, lang, part)] = ('part', idx, lang, part)
+
+    indexes = {}
+    for idx, module in enumerate(tree.modules):
+        indexes.setdefault(module.number, idx)
+        _add_module(idx, 'it', module)
+    for translated in tree.translations:
+        if translated.number in indexes:
+            _add_module(indexes[translated.number], 'en', translated)
+    if full_course:
+        plan[FULL_COURSE_HTML.name] = ('full', None, 'it')
+    return plan
+
+
+def iter_page(ctx: RenderContext, entry):
+    kind, idx, lang = entry[:3]
+    if kind == 'home':
+        return iter_home_page(ctx)
+    if kind == 'full':
+        return iter_full_course_page(ctx)
+    translated = ctx.en_translations[ctx.modules[idx]['number']] if lang == 'en' else None
+    if kind == 'part':
+        return iter_module_part_page(ctx, idx, entry[3], lang, translated)
+    if lang == 'en':
+        return iter_module_page(ctx, idx, lang='en', translated_module=translated)
+    return iter_module_page(ctx, idx)
+
+
+def page_parts(plan, modules):
+    # {part page: module page it was split from}
+    return {
+        name: module_filename(modules[entry[1]]['number'], entry[2])
+        for name, entry in plan.items() if entry[0] == 'part'
+    }
+
+
+def emit_page(ctx: RenderContext, plan, name: str, check: bool = False):
+    path = Path(name)
+    collector = ReferenceCollector()
+    with PROFILER.span(name, 'page'):
+        chunks = collector.scan(iter_page(ctx, plan[name]))
+        if check:
+            status = 'ok' if path.exists() and _file_digest(path) == digest_chunks(chunks) else 'differs'
+        else:
+            status = '' if write_chunks_if_changed(path, chunks) else 'unchanged'
+    return status, collector.as_dict()
+
+
+_WORKER_STATE = {}
+
+
+def _init_worker(ctx, plan, check, profile):
+    # Runs once per worker process: the render context (parsed course and
+    # shared fragments) is pickled once per worker instead of once per page.
+    _WORKER_STATE.update(ctx=ctx, plan=plan, check=check)
+    PROFILER.enabled = profile
+    # A forked worker inherits the parent's spans; only its own are sent back.
+    PROFILER.events.clear()
+
+
+def _emit_page_in_worker(name: str):
+    status, refs = emit_page(_WORKER_STATE['ctx'], _WORKER_STATE['plan'], name, _WORKER_STATE['check'])
+    return name, status, refs, PROFILER.drain()
+
+
+def emit_pages(ctx: RenderContext, plan, names, jobs: int = 1, check: bool = False):
+    if jobs == 1 or len(names) < 2:
+        return [(name, *emit_page(ctx, plan, name, check)) for name in names]
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(names)),
+        initializer=_init_worker,
+        initargs=(ctx, plan, check, PROFILER.enabled),
+    ) as pool:
+        results = []
+        for name, status, refs, events in pool.map(_emit_page_in_worker, names):
+            PROFILER.events.extend(events)
+            results.append((name, status, refs))
+        return results
+
+
+MARKDOWN_LINK_RE = re.compile(r'\]\(([^)\s]+)\)')
+GENERATED_PAGE_RE = re.compile(r'^module-\d+(?:-en)?(?:-part-\d+)?\.html$')
+
+
+def course_files(markdown: str):
+    # Local files course.md points at: figures and link targets (hand-written pages, downloads).
+    refs = referenced_images(markdown) + MARKDOWN_LINK_RE.findall(markdown)
+    paths = (_local_reference(ref) for ref in refs)
+    return sorted({path for path in paths if path is not None})
+
+
+def _is_build_output(path: Path, plan=()) -> bool:
+    # Whatever the build writes itself: a same-named file next to course.md
+    # must never be placed over it.
+    name = path.name.removesuffix('.gz').removesuffix('.br')
+    return (
+        path.as_posix() in plan
+        or path.suffix in ('.gz', '.br', '.tmp')
+        or path in (HOME_HTML, FULL_COURSE_HTML, FULL_COURSE_PDF, SERVICE_WORKER)
+        or (len(path.parts) == 1 and GENERATED_PAGE_RE.match(name) is not None)
+        or any(path.parts[:len(root.parts)] == root.parts
+               for root in (CACHE_DIR, DIST_DIR, SEARCH_INDEX_DIR, OPTIMIZED_IMAGES_DIR))
+        or (path.parent == SITE_ASSETS_DIR and SITE_ASSET_RE.match(name) is not None)
+    )
+
+
+def sync_course_files(source_dir: Path, markdown: str, plan=()) -> int:
+    # An edition built outside its source directory gets the files its
+    # course.md references placed next to its pages (hardlinked when
+    # possible), so figures keep their dimensions and the output ships whole.
+    placed = 0
+    for path in course_files(markdown):
+        if _is_build_output(path, plan):
+            continue
+        source = source_dir / path
+        try:
+            stat = source.stat()
+        except OSError:
+            continue
+        try:
+            current = path.stat()
+            if (current.st_size, current.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                continue
+        except OSError:
+            pass
+        _place_file(source, path)
+        placed += 1
+    return placed
+
+
+def regenerate(incremental: bool = False, check: bool = False, jobs: int = 1, options: BuildOptions = None,
+               check_links: bool = False, quiet: bool = False, full_course: bool = False, pdf: bool = False,
+               precompress_output: bool = False, source: Path = None):
+    # Reads `source` (course.md by default) and writes every output relative
+    # to the current directory.
+    source = Path(source or COURSE_MD)
+    options = options or BuildOptions()
+    with PROFILER.span('load course'):
+        markdown = source.read_text(encoding='utf-8')
+        course, tree = load_course(markdown, save=not check, quiet=quiet)
+    title, modules, *_ = course
+    if not title:
+        raise SystemExit(f'Missing course title in {source}')
+    if not modules:
+        raise SystemExit(f'No modules found in {source} (expected headings like: ## Modulo 01: Titolo)')
+
+    plan = plan_pages(tree, full_course or pdf, options.split_sections)
+    if not check and source.resolve().parent != Path.cwd().resolve():
+        with PROFILER.span('course files'):
+            placed = sync_course_files(source.resolve().parent, markdown, plan)
+        if placed and not quiet:
+            print(f'Placed {placed} file(s) referenced by {source}')
+    parts = page_parts(plan, modules)
+    with PROFILER.span('images'):
+        sources = referenced_images(markdown)
+        images = optimize_images(sources, jobs, encode=not check) if options.optimize_images else {}
+        dimensions = read_image_dimensions(sources, save=not check)
+    with PROFILER.span('input digests'):
+        inputs = input_digests(course, tree, options)
+        inputs['images'] = _digest(json.dumps([images, dimensions], sort_keys=True))
+        pages = page_digests(inputs)
+        pages.update((name, _digest(pages[parent], name)) for name, parent in parts.items())
+        manifest = load_manifest() if incremental and not check else {}
+    previous = manifest.get('pages', {})
+    previous_references = manifest.get('references', {})
+
+    fresh = {
+        name for name in plan
+        if previous.get(name) == pages[name] and name in previous_references and Path(name).exists()
+    }
+    pending = [name for name in plan if name not in fresh]
+    with PROFILER.span('render context'):
+        ctx = RenderContext.from_course(course, options, images, dimensions, tree) if pending else None
+    with PROFILER.span('pages'):
+        emitted = emit_pages(ctx, plan, pending, jobs=jobs, check=check)
+    results = {name: (status, refs) for name, status, refs in emitted}
+    generated = [(name, 'skipped' if name in fresh else results[name][0]) for name in plan]
+    references = {name: previous_references[name] if name in fresh else results[name][1] for name in plan}
+
+    if options.external_assets:
+        with PROFILER.span('site assets'):
+            assets = site_assets()
+        if check:
+            generated.extend(
+                (path, 'ok' if Path(path).exists() and Path(path).read_text(encoding='utf-8') == content else 'differs')
+                for path, content in assets.values()
+            )
+        else:
+            written = write_site_assets(assets)
+            generated.extend((path, '' if path in written else 'unchanged') for path, _ in assets.values())
+    elif not check:
+        prune_site_assets()
+
+    search = search_digests(inputs)
+    previous_search = manifest.get('search')
+    previous_search = previous_search if isinstance(previous_search, dict) else {}
+    search_paths = {lang: (SEARCH_INDEX_DIR / f'{lang}.json').as_posix() for lang in SEARCH_LANGS}
+    stale_langs = [
+        lang for lang in SEARCH_LANGS
+        if check or previous_search.get(lang) != search[lang] or not Path(search_paths[lang]).exists()
+    ]
+    shards = {}
+    if stale_langs:
+        with PROFILER.span('search index'):
+            shards = search_indexes(tree, inputs, stale_langs, cache_path=None if check else SEARCH_CACHE)
+    for lang in SEARCH_LANGS:
+        path = search_paths[lang]
+        if path not in shards:
+            generated.append((path, 'skipped'))
+            continue
+        content = shards[path]
+        if check:
+            status = 'ok' if Path(path).exists() and Path(path).read_text(encoding='utf-8') == content else 'differs'
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            status = '' if write_if_changed(Path(path), content) else 'unchanged'
+        generated.append((path, status))
+
+    if pdf and not check:
+        status = dict(generated)[FULL_COURSE_HTML.name]
+        if status == '' or not FULL_COURSE_PDF.exists():
+            with PROFILER.span('pdf'):
+                export_pdf()
+            generated.append((FULL_COURSE_PDF.name, ''))
+        else:
+            generated.append((FULL_COURSE_PDF.name, 'skipped'))
+
+    if options.service_worker or SERVICE_WORKER.exists():
+        with PROFILER.span('service worker'):
+            if options.service_worker:
+                files = precache_files(generated, references)
+                content = service_worker_source(precache_manifest(files, save=not check))
+            else:
+                content = SERVICE_WORKER_RETIRED_SOURCE
+        if check:
+            matches = SERVICE_WORKER.exists() and SERVICE_WORKER.read_text(encoding='utf-8') == content
+            status = 'ok' if matches else 'differs'
+        else:
+            status = '' if write_if_changed(SERVICE_WORKER, content) else 'unchanged'
+        generated.append((SERVICE_WORKER.name, status))
+
+    if not check:
+        for stale in Path('.').glob('module-*-part-*.html'):
+            if MODULE_PART_RE.match(stale.name) and stale.name not in plan:
+                stale.unlink()
+        # Left by an earlier --full-course build: dist/ would publish it stale.
+        if FULL_COURSE_HTML.name not in plan:
+            FULL_COURSE_HTML.unlink(missing_ok=True)
+
+    if precompress_output and not check:
+        with PROFILER.span('precompress'):
+            compressed, removed = precompress(generated, jobs, quiet)
+        if not quiet and (compressed or removed):
+            print(f'Compressed {len(compressed)} file(s), removed {len(removed)} stale sibling(s)')
+    elif not check:
+        with PROFILER.span('stale siblings'):
+            removed = remove_stale_siblings()
+        if not quiet and removed:
+            print(f'Removed {len(removed)} stale precompressed sibling(s)')
+
+    with PROFILER.span('check references'):
+        reference_report = check_references(references, parts=parts)
+    if not check:
+        update_build_report('references', reference_report)
+
+    if check:
+        stale = [name for name, status in generated if status != 'ok']
+        if not quiet:
+            print(f'Checked {len(generated)} HTML files against {source}:')
+            for name, status in generated:
+                print(f'- {name} ({status})')
+    else:
+        with PROFILER.span('save manifest'):
+            save_manifest({'inputs': inputs, 'pages': pages, 'references': references, 'search': search})
+        if not quiet:
+            print(f'Generated {len(generated)} HTML files from {source}:')
+            for name, status in generated:
+                print(f'- {name}' + (f' ({status})' if status else ''))
+
+    broken = reference_report['broken']
+    if broken and not quiet:
+        print(f'{len(broken)} broken reference(s):')
+        for item in broken:
+            print(f"- {item['page']}: {item['kind']} {item['ref']} ({item['reason']})")
+    if check and stale:
+        raise SystemExit(f'{len(stale)} page(s) differ from the generator output; run scripts/regenerate_index.py')
+    if check_links and broken:
+        raise SystemExit(f'{len(broken)} broken reference(s); see {BUILD_REPORT}')
+    return generated
+
+
+def load_course_manifest(path: Path):
+    # {"courses": [{"name": ..., "source": "ed-2025/course.md", "output": "ed-2025/site"}, ...]};
+    # relative paths are resolved against the manifest's directory.
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError) as exc:
+        raise SystemExit(f'Cannot read course manifest {path}: {exc}')
+    base = path.resolve().parent
+    courses = []
+    for index, entry in enumerate(data.get('courses', [])):
+        if 'source' not in entry or 'output' not in entry:
+            raise SystemExit(f'{path}: course #{index + 1} needs "source" and "output"')
+        output = base / entry['output']
+        courses.append({
+            'name': entry.get('name') or output.name,
+            'source': (base / entry['source']).as_posix(),
+            'output': output.as_posix(),
+        })
+    if not courses:
+        raise SystemExit(f'{path}: no courses listed')
+    names = [course['name'] for course in courses]
+    if len(set(names)) != len(names):
+        raise SystemExit(f'{path}: course names must be unique')
+    return courses
+
+
+def build_course(course, build_kwargs):
+    # One edition, built from inside its output root. Compiled patterns,
+    # templates and the inline/slug caches live in the process and are
+    # reused by every edition it builds.
+    started = time.perf_counter()
+    cwd = os.getcwd()
+    try:
+        Path(course['output']).mkdir(parents=True, exist_ok=True)
+        os.chdir(course['output'])
+        generated = regenerate(source=Path(course['source']), quiet=True, **build_kwargs)
+        error = None
+        broken = len(load_manifest(BUILD_REPORT).get('references', {}).get('broken', []))
+    except SystemExit as exc:
+        generated, error, broken = [], str(exc), 0
+    except Exception as exc:
+        generated, error, broken = [], f'{type(exc).__name__}: {exc}', 0
+    finally:
+        os.chdir(cwd)
+    counts = {}
+    for _, status in generated:
+        counts[status or 'written'] = counts.get(status or 'written', 0) + 1
+    return course['name'], time.perf_counter() - started, counts, broken, error
+
+
+def build_courses(courses, jobs: int = 1, **build_kwargs):
+    started = time.perf_counter()
+    if jobs == 1 or len(courses) < 2:
+        results = [build_course(course, build_kwargs) for course in courses]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(courses))) as pool:
+            results = list(pool.map(build_course, courses, [build_kwargs] * len(courses)))
+    elapsed = time.perf_counter() - started
+
+    print(f'{"course":<28} {"ms":>8}  files')
+    for name, seconds, counts, broken, error in results:
+        summary = error or ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+        if broken and not error:
+            summary += f', {broken} broken reference(s)'
+        print(f'{name:<28} {seconds * 1000:>8.1f}  {summary}')
+    failed = [name for name, _, _, _, error in results if error]
+    print(f'Built {len(results) - len(failed)}/{len(results)} course(s) in {elapsed * 1000:.0f} ms (jobs={jobs})')
+    if failed:
+        raise SystemExit(f'{len(failed)} course(s) failed: {", ".join(failed)}')
+    return results
+
+
+LIVERELOAD_PATH = '/__livereload'
+LIVERELOAD_SCRIPT = (
+    f"<script>new EventSource('{LIVERELOAD_PATH}').onmessage = () => window.location.reload();</script>"
+)
+# Editors save in bursts (write, rename, chmod): wait this long for the burst to end.
+WATCH_DEBOUNCE = 0.03
+WATCH_POLL_INTERVAL = 0.25
+
+
+def _is_generated_asset(path: Path) -> bool:
+    return (
+        OPTIMIZED_IMAGES_DIR.name in path.parts
+        or SEARCH_INDEX_DIR.name in path.parts
+        or SITE_ASSET_RE.match(path.name) is not None
+        or path.suffix in ('.tmp', '.gz', '.br')
+    )
+
+
+def _watched_directories():
+    directories = [SITE_ASSETS_DIR] if SITE_ASSETS_DIR.is_dir() else []
+    directories += [p for p in SITE_ASSETS_DIR.rglob('*') if p.is_dir() and not _is_generated_asset(p)]
+    return directories
+
+
+class InotifyWatcher:
+    kind = 'inotify'
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self._add_watch(COURSE_MD.resolve().parent)
+        self.refresh()
+
+    def _add_watch(self, directory: Path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self._dirs[wd] = directory
+
+    def refresh(self):
+        # New asset subdirectories appear over time; adding an existing watch is a no-op.
+        for directory in _watched_directories():
+            self._add_watch(directory.resolve())
+
+    def _relevant(self, wd: int, name: str) -> bool:
+        directory = self._dirs.get(wd)
+        if directory is None or not name:
+            return False
+        path = directory / name
+        if path == COURSE_MD.resolve():
+            return True
+        return directory != COURSE_MD.resolve().parent and not _is_generated_asset(path)
+
+    def wait(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        relevant = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            relevant = relevant or self._relevant(wd, name)
+        return relevant
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    kind = 'polling'
+
+    def __init__(self):
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        candidates = [COURSE_MD]
+        if SITE_ASSETS_DIR.is_dir():
+            candidates += [p for p in SITE_ASSETS_DIR.rglob('*') if p.is_file() and not _is_generated_asset(p)]
+        for path in candidates:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def refresh(self):
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            if current != self._snapshot:
+                self._snapshot = current
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(WATCH_POLL_INTERVAL, remaining))
+
+    def close(self):
+        pass
+
+
+class PreviewServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, LiveReloadHandler)
+        self.build_id = 0
+        self.changed = threading.Condition()
+
+    def notify_reload(self):
+        with self.changed:
+            self.build_id += 1
+            self.changed.notify_all()
+
+
+class LiveReloadHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def end_headers(self):
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def do_GET(self):
+        if self.path == LIVERELOAD_PATH:
+            self._stream_events()
+            return
+        path = Path(self.translate_path(self.path))
+        if path.is_dir():
+            path = path / 'index.html'
+        if path.suffix == '.html' and path.is_file():
+            # Injected at serve time so the files on disk stay deployable as-is.
+            body = path.read_bytes().replace(b'</body>', LIVERELOAD_SCRIPT.encode('utf-8') + b'\n</body>', 1)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path.is_file() and self._send_precompressed(path):
+            return
+        super().do_GET()
+
+    def _send_precompressed(self, path: Path) -> bool:
+        accepted = {part.split(';')[0].strip() for part in self.headers.get('Accept-Encoding', '').split(',')}
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            sibling = path.with_name(path.name + suffix)
+            if encoding not in accepted or not _sibling_is_fresh(sibling):
+                continue
+            body = sibling.read_bytes()
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(str(path)))
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+        return False
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        server = self.server
+        seen = server.build_id
+        try:
+            while True:
+                with server.changed:
+                    server.changed.wait_for(lambda: server.build_id != seen, timeout=15)
+                if server.build_id == seen:
+                    self.wfile.write(b': keep-alive\n\n')
+                else:
+                    seen = server.build_id
+                    self.wfile.write(b'data: reload\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+def watch(port: int = 8000, jobs: int = 1, options: BuildOptions = None, poll: bool = False,
+          precompress_output: bool = False):
+    regenerate(incremental=True, jobs=jobs, options=options, precompress_output=precompress_output)
+
+    server = PreviewServer(('127.0.0.1', port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher()
+        except OSError as exc:
+            print(f'inotify unavailable ({exc}); falling back to polling')
+    watcher = watcher or PollingWatcher()
+    print(f'Serving http://127.0.0.1:{port}/ and watching {COURSE_MD} and {SITE_ASSETS_DIR}/ ({watcher.kind}); Ctrl+C to stop')
+
+    try:
+        while True:
+            if not watcher.wait(1.0):
+                continue
+            while watcher.wait(WATCH_DEBOUNCE):
+                pass
+            started = time.perf_counter()
+            try:
+                generated = regenerate(
+                    incremental=True, jobs=jobs, options=options, quiet=True, precompress_output=precompress_output
+                )
+            except SystemExit as exc:
+                print(f'Build failed: {exc}')
+                continue
+            except Exception:
+                traceback.print_exc()
+                continue
+            watcher.refresh()
+            changed = [name for name, status in generated if status == '']
+            elapsed = (time.perf_counter() - started) * 1000
+            # Only course.md and source assets wake the watcher: an asset can
+            # change (an image replaced in place) without any page changing.
+            server.notify_reload()
+            if changed:
+                print(f'Rebuilt {", ".join(changed)} in {elapsed:.0f} ms')
+            else:
+                print(f'No page changed, reloading for asset changes ({elapsed:.0f} ms)')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regenerate index.html and the module pages from course.md.')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=f'only re-render pages whose inputs changed since the last build (manifest: {BUILD_MANIFEST})',
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='render every page in memory and fail if any file on disk differs (golden check, writes nothing)',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='render pages in a pool of N worker processes (0 = one per CPU core)',
+    )
+    parser.add_argument(
+        '--external-assets',
+        action='store_true',
+        help='write STYLE/OUTLINE_STYLE and the page scripts once as content-hashed files under assets/ '
+             '(safe to serve with Cache-Control: immutable) and link them instead of inlining',
+    )
+    parser.add_argument(
+        '--critical-css',
+        action='store_true',
+        help='with --external-assets, keep a small critical CSS subset inline and load the full stylesheets '
+             'without blocking render',
+    )
+    parser.add_argument(
+        '--optimize-images',
+        action='store_true',
+        help=f'encode AVIF/WebP variants of every image referenced in {COURSE_MD} (widths {IMAGE_WIDTHS}) into '
+             f'{OPTIMIZED_IMAGES_DIR}/ and emit <picture>/srcset markup with intrinsic sizes (requires Pillow)',
+    )
+    parser.add_argument(
+        '--check-links',
+        action='store_true',
+        help='fail if any generated page references a missing file, page or heading anchor '
+             f'(the full index is always written to {BUILD_REPORT})',
+    )
+    parser.add_argument(
+        '--full-course',
+        action='store_true',
+        help=f'also stream every module, the labs and the bibliography into {FULL_COURSE_HTML} '
+             '(one document with per-module anchors and a print stylesheet)',
+    )
+    parser.add_argument(
+        '--pdf',
+        action='store_true',
+        help=f'render {FULL_COURSE_HTML} to {FULL_COURSE_PDF} with a local headless Chrome/Chromium '
+             '(implies --full-course; CHROME_BIN overrides the browser)',
+    )
+    parser.add_argument(
+        '--precompress',
+        action='store_true',
+        help='write .br (if the brotli module is installed) and .gz siblings of every generated HTML/CSS/JS/JSON '
+             f'file and of the SVGs under {SITE_ASSETS_DIR}/, skipping up-to-date ones; ratios go to {BUILD_REPORT}',
+    )
+    parser.add_argument(
+        '--dist',
+        nargs='?',
+        const=DIST_DIR,
+        type=Path,
+        metavar='DIR',
+        help=f'after the build, sync the publishable site into DIR (default: {DIST_DIR}): pages, the files they '
+             f'reference, search shards and {", ".join(d.as_posix() + "/" for d in DIST_EXTRA_DIRS)}; unchanged '
+             f'files are left alone, new ones hardlinked or copied (manifest: {DIST_MANIFEST})',
+    )
+    parser.add_argument(
+        '--courses',
+        type=Path,
+        metavar='MANIFEST',
+        help='build every course edition listed in a JSON manifest ({"courses": [{"name", "source", "output"}]}) '
+             'in this one process, with a pool of --jobs workers across courses',
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='time every build phase and page and print a table sorted by total time',
+    )
+    parser.add_argument(
+        '--profile-trace',
+        type=Path,
+        metavar='FILE',
+        help='with --profile, also write the spans as a Chrome trace-event JSON file (chrome://tracing, Perfetto)',
+    )
+    parser.add_argument(
+        '--cprofile',
+        type=Path,
+        metavar='FILE',
+        help='run the build under cProfile, dump pstats to FILE and print the hottest functions (implies --jobs 1)',
+    )
+    parser.add_argument(
+        '--split-sections',
+        action='store_true',
+        help='serve each module section after the first from its own file, loaded as the reader approaches it',
+    )
+    parser.add_argument(
+        '--service-worker',
+        action='store_true',
+        help='emit sw.js, which precaches every page and referenced file by content hash for offline use',
+    )
+    parser.add_argument(
+        '--export-ast',
+        type=Path,
+        metavar='FILE',
+        help='write the parsed course tree (headings with ids, tables, figures, lists, cards) as JSON and exit',
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help=f'rebuild incrementally whenever {COURSE_MD} or {SITE_ASSETS_DIR}/ change and serve the site with live reload',
+    )
+    parser.add_argument('--port', type=int, default=8000, help='preview server port for --watch (default: 8000)')
+    parser.add_argument('--poll', action='store_true', help='with --watch, poll for changes instead of using inotify')
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error('--jobs must be >= 0')
+    if args.critical_css and not args.external_assets:
+        parser.error('--critical-css requires --external-assets')
+    options = BuildOptions(
+        external_assets=args.external_assets,
+        critical_css=args.critical_css,
+        optimize_images=args.optimize_images,
+        split_sections=args.split_sections,
+        service_worker=args.service_worker,
+    )
+    if args.dist and args.check:
+        parser.error('--dist cannot be combined with --check')
+    if args.export_ast:
+        export_course_tree(args.export_ast)
+        return
+    if args.courses:
+        if args.watch or args.dist or args.pdf:
+            parser.error('--courses cannot be combined with --watch, --dist or --pdf')
+        build_courses(
+            load_course_manifest(args.courses),
+            jobs=args.jobs or os.cpu_count() or 1,
+            incremental=args.incremental,
+            check=args.check,
+            options=options,
+            check_links=args.check_links,
+            full_course=args.full_course,
+            precompress_output=args.precompress,
+        )
+        return
+    if args.watch:
+        if args.check:
+            parser.error('--watch cannot be combined with --check')
+        watch(
+            port=args.port,
+            jobs=args.jobs or os.cpu_count() or 1,
+            options=options,
+            poll=args.poll,
+            precompress_output=args.precompress,
+        )
+        return
+    PROFILER.enabled = args.profile or args.profile_trace is not None
+    profile = cProfile.Profile() if args.cprofile else None
+    build = functools.partial(
+        regenerate,
+        incremental=args.incremental,
+        check=args.check,
+        jobs=1 if profile else args.jobs or os.cpu_count() or 1,
+        options=options,
+        check_links=args.check_links,
+        full_course=args.full_course,
+        pdf=args.pdf,
+        precompress_output=args.precompress,
+    )
+    try:
+        with PROFILER.span('regenerate', 'build'):
+            if profile:
+                profile.runcall(build)
+            else:
+                build()
+            if args.dist:
+                with PROFILER.span('dist'):
+                    prepare_dist(args.dist)
+    finally:
+        if PROFILER.enabled:
+            print(PROFILER.table())
+        if args.profile_trace:
+            PROFILER.write_trace(args.profile_trace)
+            print(f'Trace written to {args.profile_trace}')
+        if profile:
+            args.cprofile.parent.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(args.cprofile)
+            pstats.Stats(profile).sort_stats('tottime').print_stats(20)
+            print(f'pstats written to {args.cprofile}')
 
 
 if __name__ == '__main__':
-    regenerate()
+    main()
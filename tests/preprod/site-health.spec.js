@@ -11,13 +11,19 @@ function listHtmlPages() {
     .sort();
 }
 
-test('Nessuna immagine rotta nelle pagine pubblicate', async ({ page, request }) => {
+// Missing files, pages and heading anchors are caught at build time by
+// `scripts/regenerate_index.py --check-links`; this only checks that images render.
+test('Nessuna immagine rotta nelle pagine pubblicate', async ({ page }) => {
   const pages = listHtmlPages();
   expect(pages.length).toBeGreaterThan(0);
 
   for (const fileName of pages) {
     await page.goto(`/${fileName}`, { waitUntil: 'networkidle' });
 
+    // Figures below the first screen are loading="lazy": force them in before checking.
+    await page.$$eval('img[loading="lazy"]', (imgs) => imgs.forEach((img) => { img.loading = 'eager'; }));
+    await page.waitForFunction(() => Array.from(document.images).every((img) => img.complete));
+
     const imageData = await page.$$eval('img', (imgs) =>
       imgs.map((img) => ({
         src: img.getAttribute('src') || '',
@@ -30,19 +36,6 @@ test('Nessuna immagine rotta nelle pagine pubblicate', async ({ page, request })
       expect(img.complete, `${fileName}: img #${index + 1} non completa il caricamento`).toBeTruthy();
       expect(img.naturalWidth, `${fileName}: img #${index + 1} ha larghezza naturale nulla`).toBeGreaterThan(0);
     }
-
-    const uniqueSrc = [...new Set(imageData.map((img) => img.src).filter(Boolean))];
-    for (const src of uniqueSrc) {
-      if (src.startsWith('data:') || src.startsWith('blob:')) {
-        continue;
-      }
-      const absoluteUrl = new URL(src, page.url()).toString();
-      const response = await request.get(absoluteUrl);
-      expect(
-        response.ok(),
-        `${fileName}: risorsa immagine non disponibile (${src}) -> status ${response.status()}`
-      ).toBeTruthy();
-    }
   }
 });
 
@@ -0,0 +1,66 @@
+import contextlib
+import importlib.util
+import io
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+spec = importlib.util.spec_from_file_location('regenerate_index', ROOT_DIR / 'scripts' / 'regenerate_index.py')
+regenerate_index = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = regenerate_index
+spec.loader.exec_module(regenerate_index)
+
+
+class CourseManifestTest(unittest.TestCase):
+    # Editions whose output root is not their source directory.
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp(prefix='course-manifest-'))
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.source_dir = source_dir = self.root / 'edition'
+        source_dir.mkdir()
+        markdown = (ROOT_DIR / 'course.md').read_text(encoding='utf-8')
+        (source_dir / 'course.md').write_text(markdown, encoding='utf-8')
+        self.files = [path for path in regenerate_index.course_files(markdown) if (ROOT_DIR / path).is_file()]
+        for path in self.files:
+            (source_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(ROOT_DIR / path, source_dir / path)
+        (self.root / 'courses.json').write_text(json.dumps({'courses': [
+            {'name': 'site-a', 'source': 'edition/course.md', 'output': 'site-a'},
+            {'name': 'site-b', 'source': 'edition/course.md', 'output': 'nested/site-b'},
+        ]}), encoding='utf-8')
+
+    def test_outputs_outside_the_source_dir_keep_their_figures(self):
+        courses = regenerate_index.load_course_manifest(self.root / 'courses.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = regenerate_index.build_courses(courses)
+        reference_html = (ROOT_DIR / 'module-01.html').read_text(encoding='utf-8')
+        for (name, _, _, broken, error), course in zip(results, courses):
+            output = Path(course['output'])
+            self.assertIsNone(error, name)
+            self.assertEqual(broken, 0, name)
+            for path in self.files:
+                self.assertTrue((output / path).is_file(), f'{name}: {path}')
+            html = (output / 'module-01.html').read_text(encoding='utf-8')
+            self.assertEqual(html.count(' width="'), reference_html.count(' width="'), name)
+
+    def test_links_to_generated_pages_keep_the_built_page(self):
+        course_md = self.source_dir / 'course.md'
+        with course_md.open('a', encoding='utf-8') as handle:
+            handle.write('\n[modulo 2](module-02.html)\n')
+        (self.source_dir / 'module-02.html').write_text('STALE SOURCE PAGE', encoding='utf-8')
+        courses = regenerate_index.load_course_manifest(self.root / 'courses.json')
+        for _ in range(2):
+            with contextlib.redirect_stdout(io.StringIO()):
+                regenerate_index.build_courses(courses, incremental=True)
+        for course in courses:
+            html = (Path(course['output']) / 'module-02.html').read_text(encoding='utf-8')
+            self.assertNotIn('STALE SOURCE PAGE', html, course['name'])
+
+
+if __name__ == '__main__':
+    unittest.main()